@@ -0,0 +1,92 @@
+from lionhearted import settings
+import os
+import django
+import sys
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "lionhearted.settings")
+django.setup()
+
+from django.db import connection, transaction
+from forum.models import Comment, Community, Post
+from forum import ranking
+
+"""
+Measures rescore throughput for every ranking algorithm. Generates the rows
+with generate_series inside a transaction that is rolled back at the end, so
+it is safe to point at a dev database but not meant for production.
+
+    python benchmark_ranking.py [rows]
+"""
+
+POSTS_PER_COMMENT_BATCH = 100
+
+
+def insert_posts(community, rows):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO forum_post (community_id, active, pinned, views, content,
+                plaintext, excerpt, word_count, title, comment_count, points,
+                score, posted)
+            SELECT %s, true, false, (random() * 1000)::int, '', '', '', 0,
+                'post ' || i, (random() * 50)::int, (random() * 200)::int, 0,
+                now() - random() * interval '30 days'
+            FROM generate_series(1, %s) AS i
+            """,
+            [community.id, rows],
+        )
+
+
+def insert_comments(community, rows):
+    post_ids = list(
+        Post.objects.filter(community=community).values_list("id", flat=True)[
+            : max(rows // POSTS_PER_COMMENT_BATCH, 1)
+        ]
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO forum_comment (post_id, content, plaintext, excerpt,
+                word_count, points, score, posted)
+            SELECT (%s::int[])[1 + i %% %s], '', '', '', 0, (random() * 200)::int,
+                0, now() - random() * interval '30 days'
+            FROM generate_series(1, %s) AS i
+            """,
+            [post_ids, len(post_ids), rows],
+        )
+
+
+def run(model, objs, algorithms, rows):
+    for name in algorithms:
+        start = time.time()
+        objs.update(score=ranking.expression(model, name))
+        elapsed = time.time() - start
+        print(
+            "%-8s %-14s %8.2fs %10.0f rows/s"
+            % (model.__name__, name, elapsed, rows / elapsed)
+        )
+
+
+def benchmark(rows):
+    with transaction.atomic():
+        community = Community.objects.create(name="ranking-benchmark-" + str(rows))
+        insert_posts(community, rows)
+        insert_comments(community, rows)
+        run(
+            Post,
+            Post.objects.filter(community=community),
+            ranking.POST_ALGORITHMS,
+            rows,
+        )
+        run(
+            Comment,
+            Comment.objects.filter(post__community=community),
+            ranking.COMMENT_ALGORITHMS,
+            rows,
+        )
+        transaction.set_rollback(True)
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
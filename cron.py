@@ -6,26 +6,79 @@ import sys
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "lionhearted.settings")
 django.setup()
 
-from forum.models import Comment, Post, partial_update_objs, Community, Person
+from forum.models import (
+    Comment,
+    Post,
+    partial_update_objs,
+    Community,
+    Person,
+    recount_counters,
+    backfill_text,
+    rebuild_feeds,
+    check_feeds,
+    rescore_changed,
+    flush_views,
+    flush_reads,
+    flush_activity,
+)
+from forum.xredis import re_get, re_set
+from forum import community_cache
 from datetime import datetime, timedelta
+import pytz
+import time
 from django.utils import timezone
 from newsletter import send_digest
 from postmark.core import PMMail
 
+RESCORE_LAST_RUN = "rescore_posts:last_run"
+
 
 def rescore_posts():
     STOP_SCORING = 30
-    scored_objects = list(
-        Post.objects.filter(posted__gte=timezone.now() - timedelta(days=STOP_SCORING))
-    )
-    scored_objects += list(
-        Comment.objects.filter(
-            posted__gte=timezone.now() - timedelta(days=STOP_SCORING)
-        )
-    )
-    for so in scored_objects:
-        if so.should_rescore:
-            so.rescore()
+    start = time.time()
+    now = timezone.now()
+    last_run = re_get(RESCORE_LAST_RUN)
+    since = None
+    if last_run is not None:
+        since = datetime.fromtimestamp(float(last_run), pytz.UTC)
+    processed = rescore_changed(since, now - timedelta(days=STOP_SCORING))
+    re_set(RESCORE_LAST_RUN, now.timestamp())
+    print("Rescored %d rows in %.2fs" % (processed, time.time() - start))
+
+
+def flush_post_views():
+    views, viewers = flush_views()
+    print("Flushed %d views, %d unique viewers" % (views, viewers))
+
+
+def flush_read_receipts():
+    print("Flushed %d chat read receipts" % flush_reads())
+
+
+def flush_active_users():
+    print("Flushed %d active user days" % flush_activity())
+
+
+def backfill_post_text():
+    print("Backfilled text of %d rows" % backfill_text())
+
+
+def rebuild_all_feeds():
+    for c in Community.objects.all():
+        rebuild_feeds(c)
+
+
+def check_all_feeds():
+    for c in Community.objects.all():
+        bad = check_feeds(c)
+        if bad:
+            print(c.name + ": rebuilding, inconsistent " + ", ".join(bad))
+            rebuild_feeds(c)
+
+
+def print_cache_stats():
+    for name, value in sorted(community_cache.stats().items()):
+        print("%s: %s" % (name, value))
 
 
 def send_newsletter_digests():
@@ -40,6 +93,7 @@ def send_newsletter_digests():
                 filter_days = 7
             posts = (
                 c.post_set.all()
+                .defer("content", "plaintext")
                 .order_by("-posted")
                 .filter(posted__gte=timezone.now() - timedelta(days=filter_days))
             )
@@ -56,6 +110,7 @@ def send_newsletter_digests():
                 filter_days = 7
             posts = (
                 p.community.post_set.all()
+                .defer("content", "plaintext")
                 .order_by("-posted")
                 .filter(posted__gte=timezone.now() - timedelta(days=filter_days))
             )
@@ -71,6 +126,22 @@ if __name__ == "__main__":
     if len(sys.argv) > 1:
         if sys.argv[1] == "--rescore-posts":
             rescore_posts()
+        elif sys.argv[1] == "--flush-views":
+            flush_post_views()
+        elif sys.argv[1] == "--flush-reads":
+            flush_read_receipts()
+        elif sys.argv[1] == "--flush-activity":
+            flush_active_users()
+        elif sys.argv[1] == "--recount-counters":
+            recount_counters()
+        elif sys.argv[1] == "--backfill-text":
+            backfill_post_text()
+        elif sys.argv[1] == "--rebuild-feeds":
+            rebuild_all_feeds()
+        elif sys.argv[1] == "--check-feeds":
+            check_all_feeds()
+        elif sys.argv[1] == "--cache-stats":
+            print_cache_stats()
         elif sys.argv[1] == "--send-newsletter-digests":
             send_newsletter_digests()
         else:
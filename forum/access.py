@@ -0,0 +1,139 @@
+import json
+from .xredis import re
+
+"""
+What a person can see, computed once and shared by every access check: the
+channels of their community (and any they are a private member of), and
+the chatrooms they can read.
+
+Contexts are memoized on the Person instance for the request and cached in
+Redis across requests. Each community has a version counter that changes
+to channels, chatrooms or admins bump, and each person one that their
+membership changes bump; a cached context is only used if it was built at
+both current versions, so a context loaded while either changed is never
+used afterwards.
+"""
+
+CACHE_SECONDS = 24 * 60 * 60
+
+
+class ViewerContext:
+    def __init__(
+        self,
+        community_id,
+        admin,
+        superadmin_api_only,
+        channels,
+        channel_members,
+        chatrooms,
+        chatroom_members,
+    ):
+        self.community_id = community_id
+        self.admin = admin
+        self.superadmin_api_only = superadmin_api_only
+        # channel id -> private, for the community's channels and any
+        # channel the person is a private member of
+        self.channels = channels
+        self.channel_members = channel_members
+        # public chatrooms of the community
+        self.chatrooms = chatrooms
+        self.chatroom_members = chatroom_members
+
+    def can_access_channel(self, channel_id):
+        if channel_id not in self.channels:
+            return False
+        return (
+            not self.channels[channel_id]
+            or self.admin
+            or channel_id in self.channel_members
+        )
+
+    def allowed_channel_ids(self):
+        return [c for c in self.channels if self.can_access_channel(c)]
+
+    def public_channel_ids(self):
+        return [c for c, private in self.channels.items() if not private]
+
+    def private_channel_ids(self):
+        return [
+            c
+            for c, private in self.channels.items()
+            if private and self.can_access_channel(c)
+        ]
+
+    def can_access_chatroom(self, chatroom_id):
+        return chatroom_id in self.chatrooms or chatroom_id in self.chatroom_members
+
+    def allowed_chatroom_ids(self):
+        if self.superadmin_api_only:
+            return list(self.chatrooms)
+        return list(self.chatrooms | self.chatroom_members)
+
+    def to_json(self, version):
+        return json.dumps(
+            {
+                "version": version,
+                "community_id": self.community_id,
+                "admin": self.admin,
+                "superadmin_api_only": self.superadmin_api_only,
+                "channels": list(self.channels.items()),
+                "channel_members": list(self.channel_members),
+                "chatrooms": list(self.chatrooms),
+                "chatroom_members": list(self.chatroom_members),
+            }
+        )
+
+    @classmethod
+    def from_json(cls, data):
+        data = json.loads(data)
+        return cls(
+            data["community_id"],
+            data["admin"],
+            data["superadmin_api_only"],
+            dict(data["channels"]),
+            set(data["channel_members"]),
+            set(data["chatrooms"]),
+            set(data["chatroom_members"]),
+        )
+
+
+def _version_key(community_id):
+    return "access:version:%d" % community_id
+
+
+def _person_version_key(person_id):
+    return "access:person:%d" % person_id
+
+
+def _context_key(person_id):
+    return "access:viewer:%d" % person_id
+
+
+def cached_context(person, load):
+    pipe = re.pipeline(transaction=False)
+    pipe.get(_version_key(person.community_id))
+    pipe.get(_person_version_key(person.id))
+    pipe.get(_context_key(person.id))
+    community_version, person_version, data = pipe.execute()
+    version = [int(community_version or 0), int(person_version or 0)]
+    if data is not None and json.loads(data)["version"] == version:
+        return ViewerContext.from_json(data)
+    context = load()
+    re.set(_context_key(person.id), context.to_json(version), ex=CACHE_SECONDS)
+    return context
+
+
+def invalidate_community(community_id):
+    re.incr(_version_key(community_id))
+
+
+def invalidate_people(person_ids):
+    if not person_ids:
+        return
+    pipe = re.pipeline(transaction=False)
+    for person_id in person_ids:
+        # Every context built at an older version expires before this does
+        pipe.incr(_person_version_key(person_id))
+        pipe.expire(_person_version_key(person_id), CACHE_SECONDS)
+    pipe.delete(*[_context_key(p) for p in person_ids])
+    pipe.execute()
@@ -20,7 +20,7 @@ from django.http import (
     JsonResponse,
 )
 from django.utils import timezone
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from rest_framework.permissions import AllowAny
 from .utils import *
@@ -42,6 +42,7 @@ import json
 import django_rq
 from .jobs import comment_created, object_liked
 from .xredis import re_publish, re_get, re_set
+from . import presence
 
 
 """
@@ -143,6 +144,21 @@ def active_users(community):
     }
 
 
+def activity_summary(community):
+    """
+    Returns the people online now and the daily and monthly active user
+    counts, read from the Redis activity bitmaps.
+    """
+    today = date.today()
+    return {
+        "online": len(presence.online_ids(community.id)),
+        "daily": presence.daily_active(community.id, today),
+        "monthly": presence.active_between(
+            community.id, today - timedelta(days=29), today
+        ),
+    }
+
+
 def new_users(community):
     """
     Returns a dict containing the number of new users in a community.
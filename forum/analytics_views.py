@@ -43,6 +43,7 @@ Views for the admin dashboard relating to community analytics.
 # Each metric maps to a function in analytics_utils.py.
 METRIC_TYPES = {
     "ACTIVE_USERS": active_users,
+    "ACTIVITY_SUMMARY": activity_summary,
     "NEW_USERS": new_users,
     "POWER_USERS": power_users,
     "POST_VIEWS": post_views,
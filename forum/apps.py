@@ -7,4 +7,9 @@ class ForumConfig(AppConfig):
     name = "forum"
 
     def ready(jjd):
-        analytics.write_key = settings.SEGMENT_WRITE_KEY
\ No newline at end of file
+        analytics.write_key = settings.SEGMENT_WRITE_KEY
+
+        from . import identity
+        from .models import Channel, Community, Person
+
+        identity.install([Community, Person, Channel], jjd.get_models())
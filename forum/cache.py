@@ -0,0 +1,89 @@
+from cachetools import TTLCache
+from .xredis import re
+
+"""
+Host <-> community lookups, which nearly every request and every email link
+needs and which almost never change. A small per-process TTL cache sits in
+front of two Redis hashes; CommunityHost and Community signals delete the
+Redis entries, and other processes pick the change up within LOCAL_TTL.
+
+Also post -> community, which never changes once a post exists, in a key
+per post that expires after POST_TTL, so deleted and rarely read posts drop
+out of Redis.
+
+Lookups that find nothing are remembered in keys of their own that expire
+after MISSING_TTL, so requests for made-up hosts can't grow the hashes.
+"""
+
+LOCAL_TTL = 60
+MISSING_TTL = 60
+HOST_COMMUNITY = "hosts:community"
+COMMUNITY_DOMAIN = "hosts:domain"
+POST_COMMUNITY = "posts:community:%s"
+POST_TTL = 24 * 60 * 60
+
+_local = TTLCache(maxsize=2048, ttl=LOCAL_TTL)
+
+
+def _missing_key(hash_key, field):
+    return "%s:missing:%s" % (hash_key, field)
+
+
+def _cached(hash_key, field, load):
+    field = str(field)
+    if (hash_key, field) in _local:
+        return _local[(hash_key, field)]
+    pipe = re.pipeline(transaction=False)
+    pipe.hget(hash_key, field)
+    pipe.exists(_missing_key(hash_key, field))
+    value, missing = pipe.execute()
+    if value is not None:
+        value = value.decode("utf-8")
+    elif not missing:
+        value = load()
+        if value is not None:
+            re.hset(hash_key, field, value)
+        else:
+            re.set(_missing_key(hash_key, field), 1, ex=MISSING_TTL)
+    _local[(hash_key, field)] = value
+    return value
+
+
+def community_id_for_host(host, load):
+    """
+    load() returns the community id from the database, or None for an
+    unknown host; unknown hosts are cached too.
+    """
+    value = _cached(HOST_COMMUNITY, host, load)
+    return None if value is None else int(value)
+
+
+def community_id_for_post(post_id, load):
+    local_key = (POST_COMMUNITY, str(post_id))
+    if local_key in _local:
+        return _local[local_key]
+    value = re.get(POST_COMMUNITY % post_id)
+    if value is None:
+        value = load()
+        if value is None:
+            return None
+        re.set(POST_COMMUNITY % post_id, value, ex=POST_TTL)
+    _local[local_key] = int(value)
+    return int(value)
+
+
+def domain_for_community(community_id, load):
+    return _cached(COMMUNITY_DOMAIN, community_id, load)
+
+
+def invalidate_host(host, community_id):
+    re.hdel(HOST_COMMUNITY, host)
+    re.delete(_missing_key(HOST_COMMUNITY, host))
+    invalidate_domain(community_id)
+    _local.pop((HOST_COMMUNITY, host), None)
+
+
+def invalidate_domain(community_id):
+    re.hdel(COMMUNITY_DOMAIN, str(community_id))
+    re.delete(_missing_key(COMMUNITY_DOMAIN, community_id))
+    _local.pop((COMMUNITY_DOMAIN, str(community_id)), None)
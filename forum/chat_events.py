@@ -0,0 +1,137 @@
+import json
+from django.db import transaction
+from .xredis import re
+
+"""
+Chat events (new messages, deletions, new conversations), published to the
+realtime Redis channels as before and also appended to a capped Redis Stream
+per community. Published payloads carry their stream id as "event_id", so
+a client that reconnects can ask for what it missed since the last id it
+saw (see replay) instead of reloading message history.
+
+Each event, and each change to someone's unread notification count, is
+also published on the community's gateway channel, with who may see it, for
+the websocket gateway (gateway.py) to fan out.
+
+Nothing is appended or published until the current transaction commits,
+so an event never refers to a row a reader can't load yet.
+"""
+
+STREAM_LENGTH = 10000
+REPLAY_LIMIT = 500
+
+
+def _stream(community_id):
+    return "chat:events:%d" % community_id
+
+
+def _parse_id(event_id):
+    """
+    Stream ids are "<ms>-<seq>"; returns a tuple that sorts like them, or
+    None if event_id isn't one.
+    """
+    try:
+        ms, seq = event_id.split("-")
+        return (int(ms), int(seq))
+    except (AttributeError, ValueError):
+        return None
+
+
+def valid_id(event_id):
+    return _parse_id(event_id) is not None
+
+
+def gateway_channel(community_id):
+    return "gateway:community:%d" % community_id
+
+
+def publish(room, channel, kind, event):
+    """
+    Appends event (a dict) to the room's community stream and publishes it
+    on channel and to the gateway, once the current transaction commits.
+    kind is "message", "delete" or "room".
+    """
+    members = (
+        list(room.private_members.values_list("id", flat=True))
+        if room.private
+        else None
+    )
+
+    def send():
+        event_id = re.xadd(
+            _stream(room.community_id),
+            {
+                "channel": str(channel),
+                "room": room.id,
+                "kind": kind,
+                "event": json.dumps(event),
+            },
+            maxlen=STREAM_LENGTH,
+        ).decode("utf-8")
+        pipe = re.pipeline(transaction=False)
+        pipe.publish(channel, json.dumps(dict(event, event_id=event_id)))
+        pipe.publish(
+            gateway_channel(room.community_id),
+            json.dumps(
+                {
+                    "type": kind,
+                    "room": room.id,
+                    "members": members,
+                    "event_id": event_id,
+                    "data": event,
+                }
+            ),
+        )
+        pipe.execute()
+
+    transaction.on_commit(send)
+
+
+def publish_notifications(community_id, person_id, count):
+    """
+    Tells the person's open sockets their unread notification count.
+    """
+    transaction.on_commit(
+        lambda: re.publish(
+            gateway_channel(community_id),
+            json.dumps({"type": "notifications", "person": person_id, "n": count}),
+        )
+    )
+
+
+def replay(community_id, since, room_ids, limit=REPLAY_LIMIT):
+    """
+    Returns the community's events after the id since, for the rooms in
+    room_ids, oldest first, as {"events", "last_event_id", "more", "reset"}.
+    Pass last_event_id back as since to continue while more is set. reset
+    means events since then have been trimmed, and the client has to reload.
+    """
+    stream = _stream(community_id)
+    oldest = re.xrange(stream, count=1)
+    if oldest and _parse_id(since) < _parse_id(oldest[0][0].decode("utf-8")):
+        return {"events": [], "last_event_id": since, "more": False, "reset": True}
+
+    # XRANGE's start is inclusive; fetch one extra for since itself
+    entries = re.xrange(stream, min=since, count=limit + 1)
+    if entries and entries[0][0].decode("utf-8") == since:
+        entries = entries[1:]
+    more = len(entries) > limit
+    entries = entries[:limit]
+
+    events = []
+    for entry_id, fields in entries:
+        if int(fields[b"room"]) not in room_ids:
+            continue
+        event = json.loads(fields[b"event"])
+        event.update(
+            event_id=entry_id.decode("utf-8"),
+            channel=fields[b"channel"].decode("utf-8"),
+            kind=fields.get(b"kind", b"message").decode("utf-8"),
+        )
+        events.append(event)
+    return {
+        "events": events,
+        "last_event_id": entries[-1][0].decode("utf-8") if entries else since,
+        "more": more,
+        "reset": False,
+    }
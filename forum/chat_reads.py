@@ -0,0 +1,62 @@
+from .xredis import re
+
+"""
+Write-behind chat read receipts. A receipt only sets a field of a Redis
+hash, keyed "<person_id>:<room_id>", to the id of the last message read, so
+a client marking a busy room read on every message costs one HSET each.
+Unread state reads the hash on top of PersonChatRoomMetadata, and cron.py
+--flush-reads writes the latest receipt per person and room to the
+database in bulk.
+"""
+
+PENDING_READS = "chat:reads:pending"
+
+
+def _field(person_id, room_id):
+    return "%d:%d" % (person_id, room_id)
+
+
+def record_read(person_id, room_id, message_id):
+    re.hset(PENDING_READS, _field(person_id, room_id), message_id)
+
+
+def pending_reads(person_id, room_ids):
+    """
+    Returns {room_id: message_id} for the person's unflushed receipts.
+    """
+    room_ids = list(room_ids)
+    if not room_ids:
+        return {}
+    values = re.hmget(PENDING_READS, [_field(person_id, r) for r in room_ids])
+    return {
+        room_id: int(value)
+        for room_id, value in zip(room_ids, values)
+        if value is not None
+    }
+
+
+def take_pending():
+    """
+    Atomically takes every receipt recorded so far. Returns
+    {(person_id, room_id): message_id}.
+    """
+    pipe = re.pipeline(transaction=True)
+    pipe.hgetall(PENDING_READS)
+    pipe.delete(PENDING_READS)
+    reads, _ = pipe.execute()
+    taken = {}
+    for field, message_id in reads.items():
+        person_id, room_id = field.decode("utf-8").split(":")
+        taken[(int(person_id), int(room_id))] = int(message_id)
+    return taken
+
+
+def restore_pending(reads):
+    """
+    Puts back what take_pending returned, for when the flush fails, without
+    overwriting receipts recorded since.
+    """
+    pipe = re.pipeline(transaction=False)
+    for (person_id, room_id), message_id in reads.items():
+        pipe.hsetnx(PENDING_READS, _field(person_id, room_id), message_id)
+    pipe.execute()
@@ -0,0 +1,51 @@
+from collections import defaultdict
+
+
+def parse_limit(value):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+class CommentTree:
+    """
+    Loads every comment on a post in one query and serves the thread from
+    memory, ordered like Comment.children (highest score first).
+
+    max_depth and max_breadth cap how much of the thread gets rendered; the
+    rest is reachable through the "load more" cursors.
+    """
+
+    def __init__(self, post, max_depth=None, max_breadth=None):
+        self.post = post
+        self.max_depth = max_depth
+        self.max_breadth = max_breadth
+        self.votes_prefetched = False
+        self.comments = list(
+            post._comments.select_related("owner").defer("plaintext")
+        )
+        self.by_id = {}
+        self._children = defaultdict(list)
+        for comment in self.comments:
+            comment.post = post
+            self.by_id[comment.id] = comment
+            self._children[comment.parent_id].append(comment)
+        for siblings in self._children.values():
+            siblings.sort(key=lambda c: (-c.score, c.id))
+
+    def children(self, parent_id, offset=0):
+        siblings = self._children.get(parent_id, [])
+        if self.max_breadth is None:
+            return siblings[offset:]
+        return siblings[offset : offset + self.max_breadth]
+
+    def remaining(self, parent_id, offset=0):
+        return max(len(self._children.get(parent_id, [])) - offset, 0)
+
+    def more(self, parent_id, shown, offset=0):
+        remaining = self.remaining(parent_id, offset + shown)
+        if not remaining:
+            return None
+        return {"cursor": str(offset + shown), "count": remaining}
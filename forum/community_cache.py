@@ -0,0 +1,139 @@
+import copy
+import json
+import os
+from collections import Counter
+from cachetools import TTLCache
+from django.db import transaction
+from redis.exceptions import RedisError
+from .xredis import re
+
+"""
+Community settings (the viewer-independent part of CommunitySerializer:
+the community's fields, links, custom fields, admins and public chatrooms)
+in two tiers: an LRU in each web and rq worker process, in front of JSON in
+Redis.
+
+Changes bump the community's generation, delete the Redis copy and publish
+the community id on INVALIDATIONS. The Redis copy records the generation
+it was loaded at and is only used at the current one, so a load that
+raced a change can't be served after it. Every process subscribes and drains the channel before each
+lookup, dropping what it was told about, so there is no listener thread;
+if the subscription breaks, the process drops everything it has. LOCAL_TTL
+bounds how long anything missed could live anyway.
+
+Hit and miss counts are kept per process and added to a Redis hash every
+STATS_EVERY lookups; stats() reads the totals back (cron.py --cache-stats).
+"""
+
+LOCAL_TTL = 5 * 60
+LOCAL_SIZE = 1024
+REDIS_TTL = 24 * 60 * 60
+INVALIDATIONS = "community_cache:invalidate"
+STATS = "community_cache:stats"
+STATS_EVERY = 100
+
+_local = TTLCache(maxsize=LOCAL_SIZE, ttl=LOCAL_TTL)
+_counts = Counter()
+_subscription = {"pid": None, "pubsub": None}
+
+
+def _key(community_id):
+    return "community_cache:settings:%d" % community_id
+
+
+def _generation_key(community_id):
+    return "community_cache:generation:%d" % community_id
+
+
+def _drain():
+    """
+    Applies pending invalidations to the local tier.
+    """
+    if _subscription["pid"] != os.getpid():
+        # New process (or first use): nothing local can be trusted
+        _local.clear()
+        pubsub = re.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(INVALIDATIONS)
+        _subscription.update(pid=os.getpid(), pubsub=pubsub)
+    try:
+        while True:
+            message = _subscription["pubsub"].get_message()
+            if message is None:
+                return
+            _local.pop(int(message["data"]), None)
+    except (RedisError, OSError):
+        _local.clear()
+        _subscription["pid"] = None
+
+
+def _count(name):
+    _counts[name] += 1
+    if sum(_counts.values()) >= STATS_EVERY:
+        pipe = re.pipeline(transaction=False)
+        for field, n in _counts.items():
+            pipe.hincrby(STATS, field, n)
+        pipe.execute()
+        _counts.clear()
+
+
+def get(community_id, load):
+    """
+    Returns a copy of the settings of the community, from load() if no tier
+    has them.
+    """
+    _drain()
+    data = _local.get(community_id)
+    if data is not None:
+        _count("local_hits")
+        return copy.deepcopy(data)
+    pipe = re.pipeline(transaction=False)
+    pipe.get(_generation_key(community_id))
+    pipe.get(_key(community_id))
+    generation, raw = pipe.execute()
+    generation = int(generation or 0)
+    cached = json.loads(raw) if raw is not None else None
+    if cached is not None and cached.get("generation") == generation:
+        _count("redis_hits")
+        data = cached["data"]
+    else:
+        _count("misses")
+        data = load()
+        re.set(
+            _key(community_id),
+            json.dumps({"generation": generation, "data": data}),
+            ex=REDIS_TTL,
+        )
+    _local[community_id] = data
+    return copy.deepcopy(data)
+
+
+def invalidate(community_id):
+    """
+    Drops the community's settings from every tier once the current
+    transaction commits.
+    """
+
+    def publish():
+        pipe = re.pipeline(transaction=False)
+        # Every copy loaded at an older generation expires before this does
+        pipe.incr(_generation_key(community_id))
+        pipe.expire(_generation_key(community_id), REDIS_TTL)
+        pipe.delete(_key(community_id))
+        pipe.publish(INVALIDATIONS, community_id)
+        pipe.execute()
+        _local.pop(community_id, None)
+
+    transaction.on_commit(publish)
+
+
+def stats():
+    counts = {
+        field.decode("utf-8"): int(n) for field, n in re.hgetall(STATS).items()
+    }
+    lookups = sum(counts.values())
+    counts["hit_rate"] = (
+        (counts.get("local_hits", 0) + counts.get("redis_hits", 0)) / lookups
+        if lookups
+        else None
+    )
+    return counts
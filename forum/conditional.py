@@ -0,0 +1,135 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.module_loading import import_string
+from urllib.parse import urlencode
+import django_rq
+import requests
+
+"""
+Conditional GETs and CDN headers for read endpoints.
+
+An endpoint names the version counters its response depends on (the ones
+render.py and response_cache.py keep, plus a per-person one here for what
+only the viewer sees). The ETag is a hash of those versions, the viewer and
+the URL, so a request whose If-None-Match still matches gets a 304 before
+anything is loaded or serialized. There is no Last-Modified: two changes
+within the same second would look unchanged at its one second granularity.
+
+Logged-out responses are public for SURROGATE_MAX_AGE and tagged with
+surrogate keys, which the model signals that bump versions also purge
+through settings.SURROGATE_PURGE_BACKEND. Vote and view counts don't go
+through signals; they're at most SURROGATE_MAX_AGE behind at the CDN.
+"""
+
+SURROGATE_MAX_AGE = 60
+
+
+def _person_version_key(person_id):
+    return "etag:version:person:%d" % person_id
+
+
+def bump_people(person_ids):
+    now = time.time()
+    cache.set_many({_person_version_key(p): now for p in person_ids}, None)
+
+
+def community_key(community_id):
+    return "community-%d" % community_id
+
+
+def chat_key(community_id):
+    return "chat-%d" % community_id
+
+
+def post_key(post_id):
+    return "post-%d" % post_id
+
+
+def _etag(request, person, versions):
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    raw = repr(
+        [
+            settings.RELEASE_VERSION,
+            request.get_host(),
+            request.path,
+            query,
+            person.id if person else None,
+            versions,
+        ]
+    )
+    return 'W/"%s"' % hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def conditional_response(request, version_keys, build, surrogate_keys=()):
+    """
+    Returns a 304 if the client's copy is still current, and build()
+    otherwise, with ETag and cache headers set.
+    """
+    person = request.user.person if request.user.is_authenticated else None
+    if person:
+        version_keys = list(version_keys) + [_person_version_key(person.id)]
+    found = cache.get_many(version_keys)
+    versions = [found.get(key, 0) for key in version_keys]
+    etag = _etag(request, person, versions)
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = build()
+        if response.status_code != 200:
+            return response
+    response["ETag"] = etag
+    if person:
+        response["Cache-Control"] = "private, no-cache"
+    else:
+        response["Cache-Control"] = "public, max-age=0, s-maxage=%d" % (
+            SURROGATE_MAX_AGE
+        )
+        if surrogate_keys:
+            response["Surrogate-Key"] = " ".join(surrogate_keys)
+    patch_vary_headers(response, ["Authorization"])
+    return response
+
+
+class NoPurge:
+    def purge(self, keys):
+        pass
+
+
+class RecordingPurge:
+    """
+    Local stand-in for a CDN, for tests and development.
+    """
+
+    purged = []
+
+    def purge(self, keys):
+        self.purged.extend(keys)
+
+
+class FastlyPurge:
+    """
+    Purges by surrogate key through the Fastly API, from the rq worker.
+    """
+
+    def purge(self, keys):
+        django_rq.enqueue(
+            requests.post,
+            "https://api.fastly.com/service/%s/purge" % settings.FASTLY_SERVICE_ID,
+            headers={
+                "Fastly-Key": settings.FASTLY_API_KEY,
+                "Surrogate-Key": " ".join(keys),
+            },
+            timeout=10,
+        )
+
+
+def purge(*keys):
+    """
+    Purges keys from the CDN once the current transaction commits.
+    """
+    backend = import_string(settings.SURROGATE_PURGE_BACKEND)()
+    transaction.on_commit(lambda: backend.purge(list(keys)))
@@ -0,0 +1,310 @@
+from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
+from .xredis import re
+
+
+"""
+Materialized post feeds. Every community keeps sorted sets of post ids in
+Redis so that hot and top pages are a ZREVRANGE instead of a sort over the
+post table.
+
+Each scope gets one set per sort:
+    feed:c<community_id>:<sort>   posts in public channels or with no channel
+    feed:ch<channel_id>:<sort>    posts in a channel, public or private
+
+Sorts are "hot" (score, pinned first), "new" (posted timestamp), and
+"top:<window>" (points) for each window in WINDOWS. Members are zero padded
+post ids so that ties come back newest first, like the "-id" tie-breaker
+on the database path.
+"""
+
+PIN_BOOST = 1e9
+WINDOWS = {
+    "day": timedelta(days=1),
+    "week": timedelta(days=7),
+    "month": timedelta(days=30),
+    "year": timedelta(days=365),
+    "all": None,
+}
+SORTS = ["hot", "new"] + ["top:" + w for w in WINDOWS]
+REBUILD_LOCK_TTL = 300
+
+
+def enabled():
+    return settings.REDIS_FEEDS
+
+
+def member(post_id):
+    return "%012d" % post_id
+
+
+def key(scope, sort):
+    return "feed:" + scope + ":" + sort
+
+
+def community_scope(community_id):
+    return "c" + str(community_id)
+
+
+def channel_scope(channel_id):
+    return "ch" + str(channel_id)
+
+
+def built_key(community_id):
+    return "feed:built:" + str(community_id)
+
+
+def is_built(community_id):
+    return enabled() and bool(re.exists(built_key(community_id)))
+
+
+def claim_rebuild(community_id):
+    return bool(
+        re.set(
+            "feed:rebuilding:" + str(community_id),
+            1,
+            nx=True,
+            ex=REBUILD_LOCK_TTL,
+        )
+    )
+
+
+def sort_for(sort_query, time_query):
+    if sort_query == "new":
+        return "new"
+    if sort_query == "top":
+        return "top:" + time_query if time_query in WINDOWS else None
+    return "hot"
+
+
+def scores(row):
+    """
+    row is a dict with pinned, score, points and posted.
+    """
+    values = {
+        "hot": row["score"] + (PIN_BOOST if row["pinned"] else 0),
+        "new": row["posted"].timestamp(),
+    }
+    now = timezone.now()
+    for window, length in WINDOWS.items():
+        if length is None or row["posted"] >= now - length:
+            values["top:" + window] = row["points"]
+    return values
+
+
+def scopes(row):
+    rtn = []
+    if row["channel_id"] is None or not row["channel_private"]:
+        rtn.append(community_scope(row["community_id"]))
+    if row["channel_id"] is not None:
+        rtn.append(channel_scope(row["channel_id"]))
+    return rtn
+
+
+def post_row(post):
+    return {
+        "id": post.id,
+        "community_id": post.community_id,
+        "channel_id": post.channel_id,
+        "channel_private": post.channel.private if post.channel_id else False,
+        "pinned": post.pinned,
+        "score": post.score,
+        "points": post.points,
+        "posted": post.posted,
+    }
+
+
+def _post_scopes(post):
+    rtn = [community_scope(post.community_id)]
+    if post.channel_id is not None:
+        rtn.append(channel_scope(post.channel_id))
+    return rtn
+
+
+def _remove(pipe, post_id, scope_list):
+    for scope in scope_list:
+        for sort in SORTS:
+            pipe.zrem(key(scope, sort), member(post_id))
+
+
+def sync_post(post, old_channel_id=None):
+    if not enabled():
+        return
+    row = post_row(post)
+    pipe = re.pipeline(transaction=False)
+    stale = _post_scopes(post)
+    if old_channel_id is not None:
+        stale.append(channel_scope(old_channel_id))
+    if not post.active:
+        _remove(pipe, post.id, stale)
+    else:
+        current = scopes(row)
+        _remove(pipe, post.id, [s for s in stale if s not in current])
+        values = scores(row)
+        for scope in current:
+            for sort in SORTS:
+                if sort in values:
+                    pipe.zadd(key(scope, sort), {member(post.id): values[sort]})
+                else:
+                    pipe.zrem(key(scope, sort), member(post.id))
+    pipe.execute()
+
+
+def remove_post(post):
+    if not enabled():
+        return
+    pipe = re.pipeline(transaction=False)
+    _remove(pipe, post.id, _post_scopes(post))
+    pipe.execute()
+
+
+def update_scores(rows):
+    """
+    Rewrites hot and top scores for posts already in their feeds (ZADD XX),
+    for bulk jobs that change scores without going through Post.save.
+    """
+    if not enabled() or not rows:
+        return
+    pipe = re.pipeline(transaction=False)
+    for row in rows:
+        values = scores(row)
+        for scope in scopes(row):
+            for sort in SORTS:
+                if sort != "new" and sort in values:
+                    pipe.zadd(
+                        key(scope, sort), {member(row["id"]): values[sort]}, xx=True
+                    )
+    pipe.execute()
+
+
+def update_post_scores(post):
+    """
+    update_scores for a single post, without looking up its channel: ZADD XX
+    is a no-op on the sets the post is not in.
+    """
+    if not enabled() or not post.active:
+        return
+    values = scores(
+        {
+            "pinned": post.pinned,
+            "score": post.score,
+            "points": post.points,
+            "posted": post.posted,
+        }
+    )
+    pipe = re.pipeline(transaction=False)
+    for scope in _post_scopes(post):
+        for sort in SORTS:
+            if sort != "new" and sort in values:
+                pipe.zadd(key(scope, sort), {member(post.id): values[sort]}, xx=True)
+    pipe.execute()
+
+
+def replace_community(community_id, channel_ids, rows):
+    """
+    Rebuilds every set of a community from rows and swaps them in atomically.
+    """
+    all_scopes = [community_scope(community_id)] + [
+        channel_scope(c) for c in channel_ids
+    ]
+    staged = {}
+    for row in rows:
+        values = scores(row)
+        for scope in scopes(row):
+            for sort, value in values.items():
+                staged.setdefault(key(scope, sort), {})[member(row["id"])] = value
+
+    pipe = re.pipeline(transaction=False)
+    for staged_key, members in staged.items():
+        pipe.delete(staged_key + ":rebuild")
+        items = list(members.items())
+        for i in range(0, len(items), 1000):
+            pipe.zadd(staged_key + ":rebuild", dict(items[i : i + 1000]))
+    pipe.execute()
+
+    pipe = re.pipeline(transaction=True)
+    for scope in all_scopes:
+        for sort in SORTS:
+            if key(scope, sort) in staged:
+                pipe.rename(key(scope, sort) + ":rebuild", key(scope, sort))
+            else:
+                pipe.delete(key(scope, sort))
+    pipe.set(built_key(community_id), 1)
+    pipe.delete("feed:rebuilding:" + str(community_id))
+    pipe.execute()
+
+
+def expected_members(community_id, channel_ids, rows):
+    expected = {}
+    for scope in [community_scope(community_id)] + [
+        channel_scope(c) for c in channel_ids
+    ]:
+        for sort in SORTS:
+            expected[key(scope, sort)] = set()
+    for row in rows:
+        values = scores(row)
+        for scope in scopes(row):
+            for sort in values:
+                expected[key(scope, sort)].add(member(row["id"]))
+    return expected
+
+
+def inconsistent_keys(community_id, channel_ids, rows):
+    if not re.exists(built_key(community_id)):
+        return [built_key(community_id)]
+    expected = expected_members(community_id, channel_ids, rows)
+    pipe = re.pipeline(transaction=False)
+    names = list(expected.keys())
+    for name in names:
+        pipe.zrange(name, 0, -1)
+    actual = pipe.execute()
+    bad = []
+    for name, members in zip(names, actual):
+        # Windows shrink between prunes, so a stale member in a top window
+        # is not a mismatch on its own.
+        members = set(m.decode("utf-8") for m in members)
+        if name.split(":")[-1] in WINDOWS and name.split(":")[-2] == "top":
+            if not expected[name] <= members:
+                bad.append(name)
+        elif members != expected[name]:
+            bad.append(name)
+    return bad
+
+
+def _prune(scope_list, sort):
+    window = WINDOWS.get(sort.split(":")[1]) if sort.startswith("top:") else None
+    if window is None:
+        return
+    cutoff = (timezone.now() - window).timestamp()
+    pipe = re.pipeline(transaction=False)
+    for scope in scope_list:
+        pipe.zrangebyscore(key(scope, "new"), "-inf", "(" + str(cutoff))
+    expired = pipe.execute()
+    pipe = re.pipeline(transaction=False)
+    for scope, members in zip(scope_list, expired):
+        if members:
+            pipe.zrem(key(scope, sort), *members)
+    pipe.execute()
+
+
+def page(scope_list, sort, offset, step):
+    """
+    Returns (post ids, has_next) for one page of the union of scope_list.
+    """
+    _prune(scope_list, sort)
+    if len(scope_list) == 1:
+        members = re.zrevrange(key(scope_list[0], sort), offset, offset + step)
+    else:
+        # Merge the heads of each set rather than ZUNIONSTORE, so private
+        # channel feeds are never served from a stale union.
+        pipe = re.pipeline(transaction=False)
+        for scope in scope_list:
+            pipe.zrevrange(key(scope, sort), 0, offset + step, withscores=True)
+        merged = {}
+        for rows in pipe.execute():
+            merged.update(rows)
+        members = sorted(merged, key=lambda m: (merged[m], m), reverse=True)
+        members = members[offset : offset + step + 1]
+    ids = [int(m) for m in members]
+    return (ids[:step], len(ids) > step)
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import close_old_connections
+from knox.auth import TokenAuthentication
+from redis.exceptions import RedisError
+from rest_framework.exceptions import AuthenticationFailed
+from .chat_events import gateway_channel
+from .xredis import re
+
+"""
+Websocket gateway (an ASGI application, see lionhearted/asgi.py) fanning
+chat events and notification counts out to open sockets, so clients don't
+poll notification_check and nothing outside this repo has to consume the
+chat channels.
+
+A client connects, then sends {"token": "<knox token>"} within AUTH_TIMEOUT.
+After that it only receives: {"type": "ready"}, then the events of its
+community it's allowed to see, as published by chat_events ("message",
+"delete", "room" with event_id and data, and "notifications" with n).
+
+Each process holds one Redis subscription per community that has sockets
+open, read on a thread of its own since redis-py is synchronous. Each
+socket has a queue of at most SEND_QUEUE frames; a socket that falls that
+far behind is closed with SLOW_CLOSE_CODE, and the client catches up with
+chat/events?since=<the last event_id it saw>.
+"""
+
+AUTH_TIMEOUT = 10
+SEND_QUEUE = 256
+POLL_SECONDS = 0.1
+RETRY_SECONDS = 0.1
+MAX_RETRY_SECONDS = 5
+AUTH_CLOSE_CODE = 4001
+SLOW_CLOSE_CODE = 4008
+
+
+def authenticate(text):
+    """
+    Returns (person id, community id) for the token in the client's first
+    message, or None.
+    """
+    close_old_connections()
+    try:
+        token = json.loads(text)["token"]
+        user, _ = TokenAuthentication().authenticate_credentials(
+            token.encode("utf-8")
+        )
+        return (user.person.id, user.person.community_id)
+    except (
+        AuthenticationFailed,
+        ObjectDoesNotExist,
+        AttributeError,
+        KeyError,
+        TypeError,
+        ValueError,
+    ):
+        return None
+    finally:
+        close_old_connections()
+
+
+class Connection:
+    def __init__(self, send, person_id, community_id):
+        self.send = send
+        self.person_id = person_id
+        self.community_id = community_id
+        self.frames = asyncio.Queue(SEND_QUEUE)
+        self.sender = None
+
+    def wants(self, event):
+        if "person" in event:
+            return event["person"] == self.person_id
+        members = event.get("members")
+        return members is None or self.person_id in members
+
+    def push(self, frame):
+        """
+        Queues frame for the socket; returns False if the queue is full.
+        """
+        try:
+            self.frames.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def run(self):
+        while True:
+            frame = await self.frames.get()
+            await self.send({"type": "websocket.send", "text": frame})
+
+    async def close(self, code):
+        if self.sender:
+            self.sender.cancel()
+        await self.send({"type": "websocket.close", "code": code})
+
+
+class Subscriptions:
+    """
+    Redis pub/sub on a thread of its own, handing each message to
+    on_message(community_id, data) on the event loop.
+    """
+
+    def __init__(self, loop, on_message):
+        self.loop = loop
+        self.on_message = on_message
+        self.changes = queue.Queue()
+        self.channels = {}
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def subscribe(self, community_id):
+        self.changes.put(("subscribe", community_id))
+
+    def unsubscribe(self, community_id):
+        self.changes.put(("unsubscribe", community_id))
+
+    def _apply(self, pubsub, action, community_id):
+        channel = gateway_channel(community_id)
+        self.channels[channel.encode("utf-8")] = community_id
+        getattr(pubsub, action)(channel)
+
+    def _run(self):
+        pubsub = re.pubsub(ignore_subscribe_messages=True)
+        change = None
+        retry = 0
+        while True:
+            try:
+                if change is None and not pubsub.subscribed:
+                    # Nothing to read until something subscribes
+                    change = self.changes.get()
+                while change is not None or not self.changes.empty():
+                    if change is None:
+                        change = self.changes.get_nowait()
+                    self._apply(pubsub, *change)
+                    change = None
+                message = pubsub.get_message(timeout=POLL_SECONDS)
+            except RedisError:
+                # redis-py reconnects and resubscribes on the next call, and
+                # the change that failed, if any, is applied again then
+                retry = min(retry * 2 or RETRY_SECONDS, MAX_RETRY_SECONDS)
+                time.sleep(retry)
+                continue
+            retry = 0
+            if message and message["type"] == "message":
+                community_id = self.channels[message["channel"]]
+                self.loop.call_soon_threadsafe(
+                    self.on_message, community_id, message["data"]
+                )
+
+
+class Gateway:
+    def __init__(self):
+        self.communities = {}
+        self.subscriptions = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            await self.websocket(receive, send)
+        elif scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                await send({"type": message["type"] + ".complete"})
+                if message["type"] == "lifespan.shutdown":
+                    return
+        else:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 404,
+                    "headers": [(b"content-type", b"text/plain")],
+                }
+            )
+            await send({"type": "http.response.body", "body": b"Not Found"})
+
+    async def websocket(self, receive, send):
+        message = await receive()
+        if message["type"] != "websocket.connect":
+            return
+        await send({"type": "websocket.accept"})
+        try:
+            message = await asyncio.wait_for(receive(), AUTH_TIMEOUT)
+        except asyncio.TimeoutError:
+            message = {}
+        if message.get("type") == "websocket.disconnect":
+            return
+        loop = asyncio.get_event_loop()
+        viewer = await loop.run_in_executor(None, authenticate, message.get("text"))
+        if viewer is None:
+            await send({"type": "websocket.close", "code": AUTH_CLOSE_CODE})
+            return
+
+        connection = Connection(send, *viewer)
+        ready = json.dumps({"type": "ready"})
+        await send({"type": "websocket.send", "text": ready})
+        self.join(connection)
+        connection.sender = asyncio.ensure_future(connection.run())
+        try:
+            # Clients have nothing more to say; wait for them to leave
+            while (await receive())["type"] != "websocket.disconnect":
+                pass
+        finally:
+            connection.sender.cancel()
+            self.leave(connection)
+
+    def join(self, connection):
+        if self.subscriptions is None:
+            self.subscriptions = Subscriptions(
+                asyncio.get_event_loop(), self.dispatch
+            )
+        connections = self.communities.setdefault(connection.community_id, set())
+        if not connections:
+            self.subscriptions.subscribe(connection.community_id)
+        connections.add(connection)
+
+    def leave(self, connection):
+        connections = self.communities.get(connection.community_id)
+        if connections is None:
+            return
+        connections.discard(connection)
+        if not connections:
+            del self.communities[connection.community_id]
+            self.subscriptions.unsubscribe(connection.community_id)
+
+    def dispatch(self, community_id, data):
+        event = json.loads(data)
+        frame = json.dumps(
+            {k: v for k, v in event.items() if k not in ("members", "person")}
+        )
+        for connection in list(self.communities.get(community_id, ())):
+            if connection.wants(event) and not connection.push(frame):
+                self.leave(connection)
+                asyncio.ensure_future(connection.close(SLOW_CLOSE_CODE))
+
+
+application = Gateway()
@@ -0,0 +1,97 @@
+import threading
+from django.db.models.fields.related_descriptors import (
+    ForwardManyToOneDescriptor,
+    ReverseOneToOneDescriptor,
+)
+
+"""
+A per-request identity map for the rows almost every request touches
+(communities, people, channels). While a request is running, foreign key
+loads of those models are served from the map, so request.user.person,
+post.owner and post.channel.community come back as the same instance
+without a query each. Outside a request (cron, jobs, the shell) nothing
+changes.
+"""
+
+_state = threading.local()
+
+
+def active():
+    return getattr(_state, "objects", None) is not None
+
+
+def get(model, pk):
+    if not active():
+        return None
+    return _state.objects.get((model, pk))
+
+
+def add(obj, _seen=None):
+    """
+    Adds obj, and the hot objects already loaded on it through
+    select_related, to the map. Objects already in the map win.
+    """
+    if not active() or obj is None:
+        return obj
+    if _seen is None:
+        _seen = set()
+    _seen.add(id(obj))
+    for related in list(obj._state.fields_cache.values()):
+        if hasattr(related, "_state") and id(related) not in _seen:
+            add(related, _seen)
+    if type(obj) in _hot_models:
+        obj = _state.objects.setdefault((type(obj), obj.pk), obj)
+    return obj
+
+
+class _ForwardDescriptor(ForwardManyToOneDescriptor):
+    def get_object(self, instance):
+        model = self.field.remote_field.model
+        obj = get(model, getattr(instance, self.field.attname))
+        if obj is None:
+            obj = add(super().get_object(instance))
+        return obj
+
+
+class _ReverseOneToOneDescriptor(ReverseOneToOneDescriptor):
+    def __get__(self, instance, cls=None):
+        obj = super().__get__(instance, cls)
+        if instance is not None:
+            add(obj)
+        return obj
+
+
+_hot_models = set()
+
+
+def install(hot_models, models):
+    """
+    Serves foreign keys from models to any of hot_models from the map, and
+    adds objects loaded through one to one reverse accessors onto them
+    (like User.person).
+    """
+    _hot_models.update(hot_models)
+    for model in models:
+        for field in model._meta.get_fields():
+            if field.many_to_one and field.related_model in _hot_models:
+                setattr(model, field.name, _ForwardDescriptor(field))
+    for hot_model in hot_models:
+        for field in hot_model._meta.get_fields():
+            if field.one_to_one and field.concrete:
+                setattr(
+                    field.remote_field.model,
+                    field.remote_field.get_accessor_name(),
+                    _ReverseOneToOneDescriptor(field.remote_field),
+                )
+
+
+class IdentityMapMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.objects = {}
+        try:
+            return self.get_response(request)
+        finally:
+            _state.objects = None
@@ -3,9 +3,16 @@ from .models import Notification
 from django.utils import timezone
 from django.db.models import Q, F, Count
 
-from django.utils.html import strip_tags
 
-from forum.models import Comment, Post, partial_update_objs, Community, Person
+from forum.models import (
+    Comment,
+    Post,
+    partial_update_objs,
+    Community,
+    Person,
+    rebuild_feeds,
+    rescore_community,
+)
 from datetime import datetime, timedelta
 from django.utils import timezone
 from django.conf import settings
@@ -45,21 +52,21 @@ def comment_created(comment):
 
 
 @job
-def object_liked(scored_object, obj_type, action_taker):
-    if scored_object.owner != action_taker:
+def object_liked(obj_type, obj_id, owner_id, action_taker_id):
+    if owner_id is not None and owner_id != action_taker_id:
         if obj_type == "Comment":
             n, created = Notification.objects.get_or_create(
-                notified_user=scored_object.owner,
-                target_comment=scored_object,
+                notified_user_id=owner_id,
+                target_comment_id=obj_id,
                 notification_type=Notification.COMMENT_LIKE,
             )
         elif obj_type == "Post":
             n, created = Notification.objects.get_or_create(
-                notified_user=scored_object.owner,
-                target_post=scored_object,
+                notified_user_id=owner_id,
+                target_post_id=obj_id,
                 notification_type=Notification.POST_LIKE,
             )
-        n.action_taker = action_taker
+        n.action_taker_id = action_taker_id
         n.read = False
         n.time = timezone.now()
         n.save()
@@ -79,7 +86,7 @@ def post_created(post):
                         "title": post.title,
                         "link": domain + "/post/" + str(post.id),
                         "author": post.owner.username,
-                        "content": strip_tags(post.content)[:100] + "...",
+                        "content": post.excerpt + "...",
                     }
                 ],
             }
@@ -111,3 +118,13 @@ def post_created(post):
                     print(response.headers)
                 except Exception as e:
                     print(str(e))
+
+
+@job
+def rebuild_community_feeds(community_id):
+    rebuild_feeds(Community.objects.get(id=community_id))
+
+
+@job
+def rescore_community_job(community_id):
+    rescore_community(Community.objects.get(id=community_id))
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.7 on 2026-10-17 14:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0087_auto_20200518_0039'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='points',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='points',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL(
+            [
+                'UPDATE forum_post SET '
+                'points = (SELECT COUNT(*) FROM forum_post_upvotes WHERE post_id = forum_post.id), '
+                'comment_count = (SELECT COUNT(*) FROM forum_comment WHERE post_id = forum_post.id)',
+                'UPDATE forum_comment SET '
+                'points = (SELECT COUNT(*) FROM forum_comment_upvotes WHERE comment_id = forum_comment.id)',
+            ],
+            migrations.RunSQL.noop,
+        ),
+    ]
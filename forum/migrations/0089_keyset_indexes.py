@@ -0,0 +1,29 @@
+# Generated by Django 2.2.7 on 2026-10-17 14:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0088_scored_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', '-posted', '-id'], name='forum_messa_room_id_58ed59_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['notified_user', '-time', '-id'], name='forum_notif_notifie_6f29bc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['community', '-pinned', '-score', '-id'], name='forum_post_communi_79b65a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['community', '-posted', '-id'], name='forum_post_communi_a015c0_idx'),
+        ),
+    ]
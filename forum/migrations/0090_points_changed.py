@@ -0,0 +1,23 @@
+# Generated by Django 2.2.7 on 2026-10-17 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0089_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='points_changed',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='points_changed',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.7 on 2026-10-17 14:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0090_points_changed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='community',
+            name='comment_ranking',
+            field=models.CharField(choices=[('top', 'top'), ('hot', 'hot'), ('rising', 'rising'), ('wilson', 'wilson')], default='top', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='community',
+            name='post_ranking',
+            field=models.CharField(choices=[('hot', 'hot'), ('top', 'top'), ('rising', 'rising'), ('controversial', 'controversial'), ('wilson', 'wilson')], default='hot', max_length=20),
+        ),
+    ]
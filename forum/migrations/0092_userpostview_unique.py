@@ -0,0 +1,31 @@
+# Generated by Django 2.2.7 on 2026-10-17 14:57
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0091_community_ranking'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userpostview',
+            name='date',
+            field=models.DateField(default=datetime.date.today),
+        ),
+        migrations.RunSQL(
+            """
+            DELETE FROM forum_userpostview a USING forum_userpostview b
+            WHERE a.person_id = b.person_id AND a.post_id = b.post_id
+            AND a.date = b.date AND a.id > b.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterUniqueTogether(
+            name='userpostview',
+            unique_together={('person', 'date', 'post')},
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.7 on 2026-10-17 14:58
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0092_userpostview_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='useractivedate',
+            name='date',
+            field=models.DateField(default=datetime.date.today),
+        ),
+        migrations.RunSQL(
+            """
+            DELETE FROM forum_useractivedate a USING forum_useractivedate b
+            WHERE a.person_id = b.person_id AND a.date = b.date AND a.id > b.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterUniqueTogether(
+            name='useractivedate',
+            unique_together={('person', 'date')},
+        ),
+    ]
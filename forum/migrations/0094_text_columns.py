@@ -0,0 +1,43 @@
+# Generated by Django 2.2.7 on 2026-10-17 15:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0093_useractivedate_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='excerpt',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='plaintext',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='word_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='excerpt',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='plaintext',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='word_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.2.7 on 2026-10-17 15:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0094_text_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='forum.Message'),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_posted',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='message_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL(
+            [
+                'UPDATE forum_chatroom SET '
+                'message_count = (SELECT COUNT(*) FROM forum_message WHERE room_id = forum_chatroom.id), '
+                'last_message_id = (SELECT id FROM forum_message WHERE room_id = forum_chatroom.id '
+                'ORDER BY posted DESC, id DESC LIMIT 1), '
+                'last_posted = (SELECT MAX(posted) FROM forum_message WHERE room_id = forum_chatroom.id)',
+            ],
+            migrations.RunSQL.noop,
+        ),
+    ]
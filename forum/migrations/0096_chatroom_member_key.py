@@ -0,0 +1,40 @@
+# Generated by Django 2.2.7 on 2026-10-17 15:21
+
+import hashlib
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_member_keys(apps, schema_editor):
+    # Same as ChatRoom.member_key_for. Where there are already several DMs
+    # between the same people, the most recently active one gets the key.
+    ChatRoom = apps.get_model('forum', 'ChatRoom')
+    rooms = (
+        ChatRoom.objects.filter(room_type='direct')
+        .prefetch_related('private_members')
+        .order_by(F('last_posted').desc(nulls_last=True), '-id')
+    )
+    seen = set()
+    for room in rooms:
+        ids = ','.join(str(i) for i in sorted({p.id for p in room.private_members.all()}))
+        raw = '%d:%s' % (room.community_id, ids)
+        key = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+        if key not in seen:
+            seen.add(key)
+            ChatRoom.objects.filter(pk=room.pk).update(member_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0095_chatroom_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='member_key',
+            field=models.CharField(blank=True, max_length=40, null=True, unique=True),
+        ),
+        migrations.RunPython(fill_member_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.7 on 2026-10-17 15:27
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0096_chatroom_member_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, null=True),
+        ),
+        migrations.RunSQL(
+            "UPDATE forum_message SET search_vector = to_tsvector('english', message)",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='forum_message_search'),
+        ),
+    ]
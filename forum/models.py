@@ -1,20 +1,42 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    Func,
+    IntegerField,
+    Max,
+    Min,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from .utils import (
     common_edit_object,
     common_get_object,
     generate_uuid_base64,
+    html_to_text,
     uuid_path,
 )
 from django.conf import settings
 from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchVector,
+    SearchVectorField,
+)
+import hashlib
 import math
-from datetime import datetime
+from datetime import date, datetime
 import pytz
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
 import os
 from algoliasearch.search_client import SearchClient
-from django.utils.html import strip_tags
 from model_utils import FieldTracker
 from django.http import Http404
 from django.core.exceptions import (
@@ -23,6 +45,21 @@ from django.core.exceptions import (
     SuspiciousOperation,
 )
 from .xredis import re_set, re_incr
+from . import (
+    access,
+    cache,
+    chat_events,
+    chat_reads,
+    community_cache,
+    conditional,
+    feeds,
+    presence,
+    ranking,
+    render,
+    response_cache,
+    view_counts,
+    votes,
+)
 
 
 client = SearchClient.create(settings.ALGOLIA_APPLICATION_ID, settings.ALGOLIA_ADMIN_KEY)
@@ -104,6 +141,12 @@ class Community(models.Model):
     )
     free = models.BooleanField(default=False)
     digest_day_of_week = models.IntegerField(choices=DAYS_OF_WEEK, default=0)
+    post_ranking = models.CharField(
+        choices=ranking.POST_CHOICES, max_length=20, default="hot"
+    )
+    comment_ranking = models.CharField(
+        choices=ranking.COMMENT_CHOICES, max_length=20, default="top"
+    )
 
     def __str__(self):
         return self.name
@@ -124,6 +167,10 @@ class Community(models.Model):
         return self._custom_fields.all().order_by("sort")
 
     def allowed_channels(self, viewer):
+        if viewer and viewer.community_id == self.id:
+            return self._channels.filter(
+                id__in=viewer.viewer_context().allowed_channel_ids()
+            )
         if viewer:
             if viewer.admin:
                 return self._channels.all()
@@ -136,6 +183,10 @@ class Community(models.Model):
         return self._chatrooms.filter(private=False)
 
     def allowed_chatrooms(self, viewer):
+        if viewer and viewer.community_id == self.id:
+            return self._chatrooms.filter(
+                id__in=viewer.viewer_context().allowed_chatroom_ids()
+            )
         if viewer:
             if viewer.superadmin_api_only:
                 return self.chatrooms
@@ -151,29 +202,33 @@ class Community(models.Model):
         return not self.private
 
     def can_access(self, viewer):
-        return self.people.filter(id=viewer.id).exists()
+        return viewer.community_id == self.id
 
     def can_edit(self, viewer):
-        return self.people.filter(id=viewer.id, admin=True).exists()
+        return viewer.community_id == self.id and viewer.admin
 
     @classmethod
     def id_from_host(cls, url):
-        try:
-            host = CommunityHost.objects.get(host=url)
-        except ObjectDoesNotExist:
+        community_id = cache.community_id_for_host(
+            url,
+            lambda: CommunityHost.objects.filter(host=url)
+            .values_list("community_id", flat=True)
+            .first(),
+        )
+        if community_id is None:
             raise Http404()
-
-        return host.community.id
+        return community_id
 
     def get_domain(self):
+        return "https://" + cache.domain_for_community(self.id, self._primary_host)
+
+    def _primary_host(self):
         host = self.hosts.filter(primary=True)
         if len(host) > 0:
-            host = host[0].host
+            return host[0].host
         elif len(self.hosts.all()) > 0:
-            host = self.hosts.all()[0].host
-        else:
-            host = self.name + ".comradery.io"
-        return "https://" + host
+            return self.hosts.all()[0].host
+        return self.name + ".comradery.io"
 
     def save(self, *args, **kwargs):
         if not self.invite_code:
@@ -183,6 +238,7 @@ class Community(models.Model):
 
     @classmethod
     def post_save(cls, sender, instance, created, *args, **kwargs):
+        cache.invalidate_domain(instance.id)
         if created:
             chatroom = ChatRoom(
                 community=instance,
@@ -239,9 +295,22 @@ class CommunityHost(models.Model):
     host = models.CharField(max_length=100, unique=True)
     primary = models.BooleanField(default=False)
 
+    tracker = FieldTracker(fields=["host"])
+
     def __str__(self):
         return self.host
 
+    @classmethod
+    def post_save(cls, sender, instance, *args, **kwargs):
+        previous = instance.tracker.previous("host")
+        if previous:
+            cache.invalidate_host(previous, instance.community_id)
+        cache.invalidate_host(instance.host, instance.community_id)
+
+    @classmethod
+    def post_delete(cls, sender, instance, *args, **kwargs):
+        cache.invalidate_host(instance.host, instance.community_id)
+
 
 class Link(models.Model):
     community = models.ForeignKey(
@@ -286,6 +355,9 @@ class Person(models.Model):
 
     tracker = FieldTracker()
 
+    # Relations _get_object loads along with the object
+    DETAIL_RELATED = ("community",)
+
     ## Feature Flag Enabled
     edit_profile_redirect_url = models.URLField(max_length=100, blank=True, null=True)
 
@@ -320,9 +392,8 @@ class Person(models.Model):
         return common_get_object(self, viewer)
 
     def can_edit(self, viewer):
-        return (
-            viewer.id == self.id
-            or self.community.people.filter(id=viewer.id, admin=True).exists()
+        return viewer.id == self.id or (
+            viewer.admin and viewer.community_id == self.community_id
         )
 
     def get_link(self):
@@ -343,7 +414,46 @@ class Person(models.Model):
         else:
             return self.external_photo_url
 
+    def viewer_context(self):
+        """
+        The access.ViewerContext for this person, memoized on the instance.
+        """
+        if not hasattr(self, "_viewer_context"):
+            self._viewer_context = access.cached_context(
+                self, self._load_viewer_context
+            )
+        return self._viewer_context
+
+    def _load_viewer_context(self):
+        channels = dict(
+            Channel.objects.filter(community_id=self.community_id).values_list(
+                "id", "private"
+            )
+        )
+        channel_members = set(self.private_channels.values_list("id", flat=True))
+        for channel_id in channel_members:
+            channels.setdefault(channel_id, True)
+        return access.ViewerContext(
+            self.community_id,
+            self.admin,
+            self.superadmin_api_only,
+            channels,
+            channel_members,
+            set(
+                ChatRoom.objects.filter(
+                    community_id=self.community_id, private=False
+                ).values_list("id", flat=True)
+            ),
+            set(self.private_chatrooms.values_list("id", flat=True)),
+        )
+
     def shared_channels(self, viewer):
+        if viewer and viewer.community_id == self.community_id:
+            context = viewer.viewer_context()
+            return Channel.objects.filter(
+                Q(id__in=context.public_channel_ids())
+                | Q(id__in=context.channel_members, private_members=self)
+            )
         channels = self.community.channels
         if viewer:
             channels = channels | viewer.private_channels.filter(
@@ -372,6 +482,16 @@ class Person(models.Model):
             ]
         ):
             cls.index_obj(instance)
+        if any(
+            key in changed for key in ["community_id", "admin", "superadmin_api_only"]
+        ):
+            access.invalidate_people([instance.id])
+        if any(
+            key in changed
+            for key in ["id", "admin", "username", "photo", "external_photo_url"]
+        ):
+            rendered_community_changed(sender, instance)
+        conditional.bump_people([instance.id])
 
     @classmethod
     def pre_delete(cls, sender, instance, using, *args, **kwargs):
@@ -411,6 +531,8 @@ class Channel(models.Model):
     private_members = models.ManyToManyField(Person, related_name="private_channels")
     post_admin_only = models.BooleanField(default=False)
 
+    DETAIL_RELATED = ("community",)
+
     def get_pretty_name(self):
         return self.emoji + " " + self.name
 
@@ -421,45 +543,131 @@ class Channel(models.Model):
         return self.community.is_public() and not self.private
 
     def can_access(self, viewer):
-        if self.private:
-            return (
-                self.private_members.filter(id=viewer.id).exists()
-                or self.community.people.filter(id=viewer.id, admin=True).exists()
-            )
-        return common_get_object(self, viewer)
+        return viewer.viewer_context().can_access_channel(self.id)
 
     def can_edit(self, viewer):
         return common_edit_object(self, viewer)
 
 
+class TextObject(models.Model):
+    """
+    Text derived from the HTML content whenever it's saved, so search
+    indexing, digests and excerpts don't parse it again.
+    """
+
+    EXCERPT_LENGTH = 100
+    TEXT_FIELDS = ("plaintext", "excerpt", "word_count")
+
+    plaintext = models.TextField(default="", blank=True)
+    excerpt = models.CharField(max_length=EXCERPT_LENGTH, default="", blank=True)
+    word_count = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    def derive_text(self):
+        self.plaintext = html_to_text(self.content)
+        self.excerpt = self.plaintext[: self.EXCERPT_LENGTH]
+        self.word_count = len(self.plaintext.split())
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "content" in update_fields:
+            self.derive_text()
+            if update_fields is not None:
+                kwargs["update_fields"] = set(update_fields) | set(self.TEXT_FIELDS)
+        super().save(*args, **kwargs)
+
+
 class ScoredObject(models.Model):
+    """
+    Subclasses set RANKING_ALGORITHMS and RANKING_FIELD, and define ranking
+    (the name of the object's ranking algorithm) and ranking_name() (a
+    Subquery selecting that name, for UPDATEs).
+    """
+
+    # Counter columns are only ever written through F() updates
+    COUNTER_FIELDS = ("points",)
+    # Written by votes.cast and rescore, never by a full save of a stale copy
+    VOTE_FIELDS = ("score", "points_changed")
+
     upvotes = models.ManyToManyField(Person, related_name="%(class)s_upvoted")
     score = models.FloatField(default=0)
+    points = models.IntegerField(default=0)
+    points_changed = models.DateTimeField(null=True, blank=True, db_index=True)
     posted = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         abstract = True
 
-    @property
-    def points(self):
-        return self.upvotes.count()
+    def save(self, *args, **kwargs):
+        if (
+            self.pk
+            and not kwargs.get("force_insert")
+            and kwargs.get("update_fields") is None
+        ):
+            kwargs["update_fields"] = [
+                f.name
+                for f in self._meta.concrete_fields
+                if not f.primary_key
+                and f.name not in self.COUNTER_FIELDS
+                and f.name not in self.VOTE_FIELDS
+            ]
+        super().save(*args, **kwargs)
 
-    @property
-    def should_rescore(self):
-        return True
+    def _votes(self, person):
+        return self.upvotes.through.objects.filter(
+            **{self._meta.model_name: self, "person": person}
+        )
 
     def user_vote(self, person):
-        return self.upvotes.filter(pk=person.id).exists()
+        return self._votes(person).exists()
+
+    @classmethod
+    def voted_ids(cls, person, ids):
+        field = cls._meta.model_name + "_id"
+        return set(
+            cls.upvotes.through.objects.filter(
+                **{field + "__in": ids, "person": person}
+            ).values_list(field, flat=True)
+        )
+
+    def add_vote(self, person):
+        return votes.cast(self, person, True)
+
+    def remove_vote(self, person):
+        return votes.cast(self, person, False)
 
     def rescore(self):
-        basis = math.log(self.points + 1, 10)
-        t = self.posted - datetime(2019, 1, 1, 0, 0, 0, 0, pytz.UTC)
-        t = t.total_seconds() / 60000.0
-        self.score = basis + t
-        self.save()
+        self.score = (
+            type(self)
+            .objects.filter(pk=self.pk)
+            .annotate(new_score=ranking.expression(type(self), self.ranking))
+            .values_list("new_score", flat=True)
+            .get()
+        )
+        self.save(update_fields=["score"])
+
+    @classmethod
+    def rescore_all(cls, objs):
+        """
+        Rescores a queryset of cls with one UPDATE per ranking algorithm.
+        QuerySet.update sends no model signals.
+        """
+        updated = 0
+        for name in cls.RANKING_ALGORITHMS:
+            updated += objs.filter(**{cls.RANKING_FIELD: name}).update(
+                score=ranking.expression(cls, name)
+            )
+        return updated
 
 
-class Post(ScoredObject):
+class Post(ScoredObject, TextObject):
+    COUNTER_FIELDS = ("points", "comment_count")
+    RANKING_ALGORITHMS = ranking.POST_ALGORITHMS
+    RANKING_FIELD = "community__post_ranking"
+    DETAIL_RELATED = ("community", "channel", "owner")
+
     community = models.ForeignKey(Community, on_delete=models.CASCADE)
     owner = models.ForeignKey(
         Person, null=True, on_delete=models.SET_NULL, related_name="_posts"
@@ -471,9 +679,16 @@ class Post(ScoredObject):
     content = models.CharField(max_length=9500)
     title = models.CharField(max_length=200)
     channel = models.ForeignKey(Channel, null=True, on_delete=models.SET_NULL)
+    comment_count = models.IntegerField(default=0)
 
     tracker = FieldTracker()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["community", "-pinned", "-score", "-id"]),
+            models.Index(fields=["community", "-posted", "-id"]),
+        ]
+
     def __str__(self):
         return self.community.name + "__" + self.title
 
@@ -495,6 +710,15 @@ class Post(ScoredObject):
     def get_link(self):
         return self.community.get_domain() + "/post/" + str(self.id)
 
+    @classmethod
+    def community_id_for(cls, post_id):
+        return cache.community_id_for_post(
+            post_id,
+            lambda: cls.objects.filter(pk=post_id)
+            .values_list("community_id", flat=True)
+            .first(),
+        )
+
     def is_public(self):
         return self.channel.is_public() if self.channel else self.community.is_public()
 
@@ -508,9 +732,21 @@ class Post(ScoredObject):
     def can_edit(self, viewer):
         return common_edit_object(self, viewer)
 
+    @property
+    def ranking(self):
+        return self.community.post_ranking
+
+    @classmethod
+    def ranking_name(cls):
+        return Subquery(
+            Community.objects.filter(pk=OuterRef("community_id")).values(
+                "post_ranking"
+            )[:1]
+        )
+
     @property
     def num_comments(self):
-        return self._comments.count()
+        return self.comment_count
 
     @property
     def comments(self):
@@ -537,7 +773,7 @@ class Post(ScoredObject):
             "posted": instance.posted.isoformat(),
             "owner": owner_obj,
             "title": instance.title,
-            "content": strip_tags(instance.content),
+            "content": instance.plaintext,
             "num_comments": instance.num_comments,
             "type": "post",
         }
@@ -560,13 +796,15 @@ class Post(ScoredObject):
             ]
         ):
             cls.index_obj(instance)
+        feeds.sync_post(instance, changed.get("channel_id"))
 
     @classmethod
     def pre_delete(cls, sender, instance, using, *args, **kwargs):
         index.delete_object("post_" + str(instance.id))
+        feeds.remove_post(instance)
 
 
-class Comment(ScoredObject):
+class Comment(ScoredObject, TextObject):
     content = models.CharField(max_length=25000)
     owner = models.ForeignKey(
         Person, null=True, on_delete=models.SET_NULL, related_name="_comments"
@@ -587,21 +825,38 @@ class Comment(ScoredObject):
         return self.post.can_access(viewer)
 
     def can_edit(self, viewer):
-        if self.owner and self.owner.id == viewer.id:
+        if self.owner_id == viewer.id:
             return True
-        return self.post.community.people.filter(id=viewer.id, admin=True).exists()
+        return viewer.admin and viewer.community_id == self.post.community_id
 
     @property
     def children(self):
         return self._children.order_by("-score")
 
+    RANKING_ALGORITHMS = ranking.COMMENT_ALGORITHMS
+    RANKING_FIELD = "post__community__comment_ranking"
+    DETAIL_RELATED = ("post__community", "post__channel", "owner")
+
     @property
-    def should_rescore(self):
-        return False
+    def ranking(self):
+        return self.post.community.comment_ranking
 
-    def rescore(self):
-        self.score = self.points
-        self.save()
+    @classmethod
+    def ranking_name(cls):
+        return Subquery(
+            Community.objects.filter(post=OuterRef("post_id")).values(
+                "comment_ranking"
+            )[:1]
+        )
+
+    def save(self, *args, **kwargs):
+        created = not self.pk
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if created:
+                Post.objects.filter(pk=self.post_id).update(
+                    comment_count=F("comment_count") + 1
+                )
 
     def user_delete(self):
         if self._children.count() > 0:
@@ -618,11 +873,19 @@ class Comment(ScoredObject):
         if created:
             index.partial_update_object(
                 {
-                    "objectID": "post_" + str(instance.post.id),
-                    "num_comments": instance.post.num_comments,
+                    "objectID": "post_" + str(instance.post_id),
+                    "num_comments": Post.objects.filter(pk=instance.post_id)
+                    .values_list("comment_count", flat=True)
+                    .first(),
                 }
             )
 
+    @classmethod
+    def post_delete(cls, sender, instance, using, *args, **kwargs):
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=F("comment_count") - 1
+        )
+
 
 class Notification(models.Model):
     COMMENT_LIKE = "CL"
@@ -654,9 +917,16 @@ class Notification(models.Model):
     should_send_email = models.BooleanField(default=False)
     notification_type = models.CharField(max_length=5, choices=NOTIFICATION_TYPES)
 
+    class Meta:
+        indexes = [models.Index(fields=["notified_user", "-time", "-id"])]
+
     def save(self, *args, **kwargs):
         if not self.pk:
-            re_incr(self.notified_user.user.username, 1)
+            chat_events.publish_notifications(
+                self.notified_user.community_id,
+                self.notified_user_id,
+                re_incr(self.notified_user.user.username, 1),
+            )
 
             if (
                 self.notification_type
@@ -681,20 +951,56 @@ class ChatRoom(models.Model):
     name = models.CharField(max_length=100, null=True, blank=True)
     private = models.BooleanField(default=True)
     room_type = models.CharField(max_length=10, choices=ROOM_TYPES)
+    # Kept up to date by Message.save and Message.post_delete
+    last_message = models.ForeignKey(
+        "Message",
+        on_delete=models.SET_NULL,
+        related_name="+",
+        null=True,
+        blank=True,
+    )
+    last_posted = models.DateTimeField(null=True, blank=True)
+    message_count = models.IntegerField(default=0)
+    # member_key_for(members) for DIRECT rooms, so there is one per set of
+    # members. Kept up to date by dm_members_changed.
+    member_key = models.CharField(
+        max_length=40, null=True, blank=True, unique=True
+    )
 
-    @property
-    def last_message(self):
-        return self.messages.order_by("-posted").first()
+    DETAIL_RELATED = ("community",)
+
+    @staticmethod
+    def member_key_for(community_id, person_ids):
+        ids = ",".join(str(i) for i in sorted(set(person_ids)))
+        raw = "%d:%s" % (community_id, ids)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def open_direct(cls, community, members):
+        """
+        Returns (room, created) for the community's DIRECT room between
+        exactly these members, creating it if there isn't one.
+        """
+        key = cls.member_key_for(community.id, [m.id for m in members])
+        room = cls.objects.filter(member_key=key).first()
+        if room:
+            return room, False
+        try:
+            with transaction.atomic():
+                room = cls.objects.create(
+                    community=community, room_type=cls.DIRECT, member_key=key
+                )
+                room.private_members.add(*members)
+        except IntegrityError:
+            # Someone else opened it first
+            return cls.objects.get(member_key=key), False
+        return room, True
 
     def is_public(self):
         return self.community.is_public() and not self.private
 
     def can_access(self, viewer):
-        return (
-            self.private_members.filter(id=viewer.id).exists()
-            if self.private
-            else common_get_object(self, viewer)
-        )
+        return viewer.viewer_context().can_access_chatroom(self.id)
 
     def descriptive_name(self, requester):
         if self.name:
@@ -729,6 +1035,46 @@ class Message(models.Model):
         ChatRoom, on_delete=models.CASCADE, related_name="messages"
     )
     posted = models.DateTimeField(auto_now_add=True)
+    search_vector = SearchVectorField(null=True, blank=True)
+
+    DETAIL_RELATED = ("room", "sender")
+    SEARCH_CONFIG = "english"
+    # ts_headline markers; control characters can't come from the chat box,
+    # so MessageSearchSerializer can escape the text and then mark it up.
+    HIGHLIGHT_START = "\x02"
+    HIGHLIGHT_STOP = "\x03"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["room", "-posted", "-id"]),
+            GinIndex(fields=["search_vector"], name="forum_message_search"),
+        ]
+
+    @classmethod
+    def search(cls, rooms, text):
+        """
+        Messages in rooms matching text, newest first, with a highlighted
+        snippet of each.
+        """
+        query = SearchQuery(text, config=cls.SEARCH_CONFIG)
+        options = "StartSel=%s, StopSel=%s" % (cls.HIGHLIGHT_START, cls.HIGHLIGHT_STOP)
+        return (
+            cls.objects.filter(room__in=rooms, search_vector=query)
+            .select_related("sender")
+            .defer("search_vector")
+            .annotate(
+                snippet=Func(
+                    Value(cls.SEARCH_CONFIG),
+                    F("message"),
+                    query,
+                    Value(options),
+                    function="ts_headline",
+                    template="%(function)s(%(expressions)s)",
+                    output_field=models.TextField(),
+                )
+            )
+            .order_by("-posted", "-id")
+        )
 
     def is_public(self):
         return self.room.is_public()
@@ -741,6 +1087,55 @@ class Message(models.Model):
             return True
         return common_edit_object(self.room, viewer)
 
+    def save(self, *args, **kwargs):
+        created = not self.pk
+        # Indexed in the same INSERT or UPDATE as the text
+        self.search_vector = SearchVector(
+            Value(self.message, output_field=models.TextField()),
+            config=self.SEARCH_CONFIG,
+        )
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "message" in update_fields:
+            kwargs["update_fields"] = list(update_fields) + ["search_vector"]
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if created:
+                # Concurrent sends can commit out of order; only move
+                # last_message forward.
+                newer = Q(last_posted__isnull=True) | Q(last_posted__lte=self.posted)
+                ChatRoom.objects.filter(pk=self.room_id).update(
+                    message_count=F("message_count") + 1,
+                    last_message=Case(
+                        When(newer, then=Value(self.pk)),
+                        default=F("last_message"),
+                        output_field=IntegerField(),
+                    ),
+                    last_posted=Case(
+                        When(newer, then=Value(self.posted)),
+                        default=F("last_posted"),
+                        output_field=models.DateTimeField(),
+                    ),
+                )
+
+    @classmethod
+    def post_delete(cls, sender, instance, using, *args, **kwargs):
+        ChatRoom.objects.filter(pk=instance.room_id).update(
+            message_count=F("message_count") - 1
+        )
+        # Deleting the last message cleared the room's last_message
+        latest = (
+            Message.objects.filter(room_id=instance.room_id)
+            .order_by("-posted", "-id")
+            .values("id", "posted")
+            .first()
+        )
+        if latest:
+            ChatRoom.objects.filter(
+                pk=instance.room_id, last_message__isnull=True
+            ).update(last_message=latest["id"], last_posted=latest["posted"])
+        else:
+            ChatRoom.objects.filter(pk=instance.room_id).update(last_posted=None)
+
 
 class PersonChatRoomMetadata(models.Model):
     person = models.ForeignKey(
@@ -763,21 +1158,181 @@ class PersonChatRoomMetadata(models.Model):
 
 class UserActiveDate(models.Model):
     person = models.ForeignKey(Person, on_delete=models.CASCADE)
-    date = models.DateField(auto_now_add=True)
+    date = models.DateField(default=date.today)
+
+    class Meta:
+        unique_together = ("person", "date")
 
 
 class UserPostView(models.Model):
     person = models.ForeignKey(Person, on_delete=models.CASCADE)
-    date = models.DateField(auto_now_add=True)
+    date = models.DateField(default=date.today)
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
 
+    class Meta:
+        unique_together = ("person", "date", "post")
+
+
+def _hides_content(sender, instance, created, signal):
+    """
+    Whether the change can take something away from logged-out readers.
+    Channel and chatroom changes are handled in access_changed.
+    """
+    if signal is post_delete or sender is Community:
+        return True
+    if sender is Post and not created:
+        return any(instance.tracker.has_changed(f) for f in ("channel_id", "active"))
+    return False
+
+
+def public_content_changed(sender, instance, created=False, *args, **kwargs):
+    if sender is Community:
+        community_id = instance.id
+    elif sender is Comment:
+        community_id = Post.community_id_for(instance.post_id)
+    else:
+        community_id = instance.community_id
+    if community_id is not None:
+        response_cache.bump(community_id)
+        if _hides_content(sender, instance, created, kwargs.get("signal")):
+            response_cache.bump_access(community_id)
+        conditional.purge(conditional.community_key(community_id))
+
+
+def rendered_post_changed(sender, instance, update_fields=None, *args, **kwargs):
+    # A post's score isn't part of its JSON (its comments' scores order them)
+    if sender is Post and update_fields and set(update_fields) == {"score"}:
+        return
+    post_id = instance.post_id if sender is Comment else instance.id
+    render.bump_post(post_id)
+    conditional.purge(conditional.post_key(post_id))
+
+
+def rendered_community_changed(sender, instance, *args, **kwargs):
+    community_id = instance.id if sender is Community else instance.community_id
+    render.bump_community(community_id)
+    community_cache.invalidate(community_id)
+
+
+def chatrooms_changed(sender, instance, created=False, *args, **kwargs):
+    # Only public rooms are part of the community's settings
+    if not (created and instance.private):
+        community_cache.invalidate(instance.community_id)
+
+
+def chat_changed(sender, instance, *args, **kwargs):
+    room = instance.room if sender is Message else instance
+    response_cache.bump(room.community_id, "chat")
+    conditional.purge(conditional.chat_key(room.community_id))
+
+
+def chatroom_read(sender, instance, *args, **kwargs):
+    conditional.bump_people([instance.person_id])
+
+
+def access_changed(sender, instance, created=False, *args, **kwargs):
+    # A new private room has no members yet, so nobody's access changes.
+    if not (created and instance.private):
+        access.invalidate_community(instance.community_id)
+        response_cache.bump_access(instance.community_id)
+
+
+def members_changed(sender, instance, action, reverse, pk_set, *args, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear", "pre_clear"):
+        return
+    if reverse:
+        person_ids = [instance.id]
+    elif action == "pre_clear":
+        person_ids = list(instance.private_members.values_list("id", flat=True))
+    elif action != "post_clear":
+        person_ids = list(pk_set)
+    else:
+        return
+    access.invalidate_people(person_ids)
+    conditional.bump_people(person_ids)
+
+
+def dm_members_changed(sender, instance, action, reverse, pk_set, *args, **kwargs):
+    if reverse and action == "pre_clear":
+        # post_clear has no pk_set, so note the person's DMs while they last
+        instance._cleared_dm_ids = list(
+            instance.private_chatrooms.filter(
+                room_type=ChatRoom.DIRECT
+            ).values_list("id", flat=True)
+        )
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        room_ids = [instance.id]
+    elif action == "post_clear":
+        room_ids = instance.__dict__.pop("_cleared_dm_ids", ())
+    else:
+        room_ids = pk_set
+    for room in ChatRoom.objects.filter(pk__in=room_ids, room_type=ChatRoom.DIRECT):
+        member_key = ChatRoom.member_key_for(
+            room.community_id, room.private_members.values_list("id", flat=True)
+        )
+        if member_key == room.member_key:
+            continue
+        try:
+            with transaction.atomic():
+                ChatRoom.objects.filter(pk=room.pk).update(member_key=member_key)
+        except IntegrityError:
+            # Another room is already the DM between these people
+            ChatRoom.objects.filter(pk=room.pk).update(member_key=None)
+
 
 post_save.connect(Post.post_save, sender=Post)
 pre_delete.connect(Post.pre_delete, sender=Post)
 post_save.connect(Comment.post_save, sender=Comment)
+post_delete.connect(Comment.post_delete, sender=Comment)
 post_save.connect(Person.post_save, sender=Person)
 pre_delete.connect(Person.pre_delete, sender=Person)
+post_save.connect(access_changed, sender=Channel)
+post_delete.connect(access_changed, sender=Channel)
+post_save.connect(access_changed, sender=ChatRoom)
+post_delete.connect(access_changed, sender=ChatRoom)
+m2m_changed.connect(members_changed, sender=Channel.private_members.through)
+m2m_changed.connect(members_changed, sender=ChatRoom.private_members.through)
+m2m_changed.connect(dm_members_changed, sender=ChatRoom.private_members.through)
+post_save.connect(public_content_changed, sender=Post)
+post_delete.connect(public_content_changed, sender=Post)
+post_save.connect(public_content_changed, sender=Comment)
+post_delete.connect(public_content_changed, sender=Comment)
+post_save.connect(public_content_changed, sender=Channel)
+post_delete.connect(public_content_changed, sender=Channel)
+post_save.connect(public_content_changed, sender=Community)
+post_delete.connect(public_content_changed, sender=Community)
+post_save.connect(public_content_changed, sender=Person)
+post_delete.connect(public_content_changed, sender=Person)
+post_save.connect(rendered_post_changed, sender=Post)
+post_delete.connect(rendered_post_changed, sender=Post)
+post_save.connect(rendered_post_changed, sender=Comment)
+post_delete.connect(rendered_post_changed, sender=Comment)
+post_save.connect(rendered_community_changed, sender=Channel)
+post_delete.connect(rendered_community_changed, sender=Channel)
+post_save.connect(rendered_community_changed, sender=Community)
+post_save.connect(public_content_changed, sender=Link)
+post_delete.connect(public_content_changed, sender=Link)
+post_save.connect(rendered_community_changed, sender=Link)
+post_delete.connect(rendered_community_changed, sender=Link)
+post_save.connect(public_content_changed, sender=CustomField)
+post_delete.connect(public_content_changed, sender=CustomField)
+post_save.connect(rendered_community_changed, sender=CustomField)
+post_delete.connect(rendered_community_changed, sender=CustomField)
+post_save.connect(chatroom_read, sender=PersonChatRoomMetadata)
+post_delete.connect(rendered_community_changed, sender=Person)
+post_save.connect(chatrooms_changed, sender=ChatRoom)
+post_delete.connect(chatrooms_changed, sender=ChatRoom)
+post_save.connect(chat_changed, sender=ChatRoom)
+post_delete.connect(chat_changed, sender=ChatRoom)
+post_save.connect(chat_changed, sender=Message)
+post_delete.connect(Message.post_delete, sender=Message)
+post_delete.connect(chat_changed, sender=Message)
 post_save.connect(Community.post_save, sender=Community)
+post_save.connect(CommunityHost.post_save, sender=CommunityHost)
+post_delete.connect(CommunityHost.post_delete, sender=CommunityHost)
 
 
 def clear_index():
@@ -787,3 +1342,284 @@ def clear_index():
 
 def partial_update_objs(objs):
     index.partial_update_objects(objs)
+
+
+def _count_subquery(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(c=Count("pk"))
+            .values("c")
+        ),
+        0,
+    )
+
+
+def recount_counters(chunk_size=5000):
+    for model in [Post, Comment]:
+        through = model.upvotes.through
+        field = model._meta.model_name
+        values = {"points": _count_subquery(through, field)}
+        if model is Post:
+            values["comment_count"] = _count_subquery(Comment, "post")
+
+        bounds = model.objects.aggregate(lo=Min("pk"), hi=Max("pk"))
+        if bounds["lo"] is None:
+            continue
+        for start in range(bounds["lo"], bounds["hi"] + 1, chunk_size):
+            model.objects.filter(pk__gte=start, pk__lt=start + chunk_size).update(
+                **values
+            )
+
+    latest = Message.objects.filter(room=OuterRef("pk")).order_by("-posted", "-id")
+    ChatRoom.objects.update(
+        message_count=_count_subquery(Message, "room"),
+        last_message=Subquery(latest.values("id")[:1]),
+        last_posted=Subquery(latest.values("posted")[:1]),
+    )
+
+
+def backfill_text(chunk_size=500):
+    """
+    Fills in the TextObject fields of rows saved before they existed, a
+    chunk at a time. Returns the number of rows updated.
+    """
+    updated = 0
+    for model in [Post, Comment]:
+        last = 0
+        while True:
+            rows = list(
+                model.objects.filter(pk__gt=last, excerpt="")
+                .order_by("pk")
+                .only("id", "content")[:chunk_size]
+            )
+            if not rows:
+                break
+            for row in rows:
+                row.derive_text()
+            model.objects.bulk_update(rows, model.TEXT_FIELDS)
+            if model is Post:
+                render.bump_posts([row.pk for row in rows])
+            updated += len(rows)
+            last = rows[-1].pk
+    return updated
+
+
+def _feed_rows(community):
+    return [
+        {
+            "id": row["id"],
+            "community_id": community.id,
+            "channel_id": row["channel_id"],
+            "channel_private": bool(row["channel__private"]),
+            "pinned": row["pinned"],
+            "score": row["score"],
+            "points": row["points"],
+            "posted": row["posted"],
+        }
+        for row in Post.objects.filter(community=community, active=True).values(
+            "id", "channel_id", "channel__private", "pinned", "score", "points", "posted"
+        )
+    ]
+
+
+def rebuild_feeds(community):
+    channel_ids = list(community._channels.values_list("id", flat=True))
+    feeds.replace_community(community.id, channel_ids, _feed_rows(community))
+
+
+def check_feeds(community):
+    channel_ids = list(community._channels.values_list("id", flat=True))
+    return feeds.inconsistent_keys(community.id, channel_ids, _feed_rows(community))
+
+
+def rescore_changed(since, posted_after, chunk_size=1000):
+    """
+    Recomputes scores in the database for objects posted after posted_after
+    whose points changed since `since` (all of them when since is None, or
+    when their community ranks with a VOLATILE algorithm), one bulk UPDATE
+    per chunk.
+    """
+    processed = 0
+    for model in [Post, Comment]:
+        objs = model.objects.filter(posted__gte=posted_after)
+        if since:
+            objs = objs.filter(
+                Q(points_changed__gte=since)
+                | Q(**{model.RANKING_FIELD + "__in": ranking.VOLATILE})
+            )
+        ids = list(objs.order_by("pk").values_list("pk", flat=True))
+        for i in range(0, len(ids), chunk_size):
+            chunk = ids[i : i + chunk_size]
+            processed += model.rescore_all(model.objects.filter(pk__in=chunk))
+            if model is Post and feeds.enabled():
+                feeds.update_scores(_feed_score_rows(chunk))
+    return processed
+
+
+def rescore_community(community):
+    Post.rescore_all(Post.objects.filter(community=community))
+    Comment.rescore_all(Comment.objects.filter(post__community=community))
+    if feeds.enabled():
+        rebuild_feeds(community)
+
+
+def _feed_score_rows(ids):
+    return [
+        {
+            "id": row["id"],
+            "community_id": row["community_id"],
+            "channel_id": row["channel_id"],
+            "channel_private": bool(row["channel__private"]),
+            "pinned": row["pinned"],
+            "score": row["score"],
+            "points": row["points"],
+            "posted": row["posted"],
+        }
+        for row in Post.objects.filter(pk__in=ids, active=True).values(
+            "id",
+            "community_id",
+            "channel_id",
+            "channel__private",
+            "pinned",
+            "score",
+            "points",
+            "posted",
+        )
+    ]
+
+
+def flush_views(chunk_size=500):
+    """
+    Applies the view counts and unique viewers buffered in Redis. Returns
+    (views, viewers) flushed.
+    """
+    counts, rows = view_counts.take_pending()
+    try:
+        with transaction.atomic():
+            items = list(counts.items())
+            for i in range(0, len(items), chunk_size):
+                chunk = items[i : i + chunk_size]
+                Post.objects.filter(pk__in=[post_id for post_id, _ in chunk]).update(
+                    views=F("views")
+                    + Case(
+                        *[When(pk=post_id, then=Value(n)) for post_id, n in chunk],
+                        default=Value(0),
+                        output_field=IntegerField(),
+                    )
+                )
+            post_ids = set(
+                Post.objects.filter(pk__in={r[1] for r in rows}).values_list(
+                    "id", flat=True
+                )
+            )
+            person_ids = set(
+                Person.objects.filter(pk__in={r[2] for r in rows}).values_list(
+                    "id", flat=True
+                )
+            )
+            UserPostView.objects.bulk_create(
+                [
+                    UserPostView(date=day, post_id=post_id, person_id=person_id)
+                    for day, post_id, person_id in rows
+                    if post_id in post_ids and person_id in person_ids
+                ],
+                batch_size=chunk_size,
+                ignore_conflicts=True,
+            )
+    except Exception:
+        view_counts.restore_pending(counts, rows)
+        raise
+    return (sum(counts.values()), len(rows))
+
+
+def last_read_ids(person_id, room_ids):
+    """
+    Returns {room_id: id of the last message read} for the rooms the person
+    has read, including receipts not flushed yet.
+    """
+    room_ids = list(room_ids)
+    reads = dict(
+        PersonChatRoomMetadata.objects.filter(
+            person_id=person_id, chatroom_id__in=room_ids, last_read__isnull=False
+        ).values_list("chatroom_id", "last_read_id")
+    )
+    reads.update(chat_reads.pending_reads(person_id, room_ids))
+    return reads
+
+
+def flush_reads(chunk_size=500):
+    """
+    Applies the chat read receipts buffered in Redis. Returns the number of
+    receipts flushed.
+    """
+    reads = chat_reads.take_pending()
+    try:
+        with transaction.atomic():
+            message_ids = set(
+                Message.objects.filter(pk__in=set(reads.values())).values_list(
+                    "id", flat=True
+                )
+            )
+            person_ids = set(
+                Person.objects.filter(
+                    pk__in={person_id for person_id, _ in reads}
+                ).values_list("id", flat=True)
+            )
+            reads = {
+                (person_id, room_id): message_id
+                for (person_id, room_id), message_id in reads.items()
+                if message_id in message_ids and person_id in person_ids
+            }
+            existing = {}
+            for metadata in PersonChatRoomMetadata.objects.filter(
+                person_id__in={person_id for person_id, _ in reads},
+                chatroom_id__in={room_id for _, room_id in reads},
+            ).only("id", "person_id", "chatroom_id", "last_read_id"):
+                key = (metadata.person_id, metadata.chatroom_id)
+                if key in reads:
+                    metadata.last_read_id = reads[key]
+                    existing.setdefault(key, []).append(metadata)
+            PersonChatRoomMetadata.objects.bulk_update(
+                [m for rows in existing.values() for m in rows],
+                ["last_read"],
+                batch_size=chunk_size,
+            )
+            PersonChatRoomMetadata.objects.bulk_create(
+                [
+                    PersonChatRoomMetadata(
+                        person_id=person_id, chatroom_id=room_id, last_read_id=message_id
+                    )
+                    for (person_id, room_id), message_id in reads.items()
+                    if (person_id, room_id) not in existing
+                ],
+                batch_size=chunk_size,
+            )
+    except Exception:
+        chat_reads.restore_pending(reads)
+        raise
+    return len(reads)
+
+
+def flush_activity(chunk_size=1000):
+    """
+    Copies finished days of the Redis activity bitmaps into UserActiveDate.
+    Returns the number of person-days flushed.
+    """
+    flushed = 0
+    for community_id, day, person_ids in presence.finished_days():
+        existing = list(
+            Person.objects.filter(
+                community_id=community_id, pk__in=person_ids
+            ).values_list("id", flat=True)
+        )
+        UserActiveDate.objects.bulk_create(
+            [UserActiveDate(person_id=person_id, date=day) for person_id in existing],
+            batch_size=chunk_size,
+            ignore_conflicts=True,
+        )
+        presence.mark_flushed(community_id, day)
+        flushed += len(existing)
+    return flushed
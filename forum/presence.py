@@ -0,0 +1,101 @@
+from datetime import date, timedelta
+from django.utils import timezone
+from .xredis import re
+
+"""
+Activity tracking in Redis. Each community has a bitmap per day with a bit
+set at every active person's id, kept for BITMAP_DAYS so daily and monthly
+active counts are BITCOUNT / BITOP OR instead of table scans. cron.py
+--flush-activity copies finished days into UserActiveDate for analytics.
+
+"Online now" is a sorted set per community of person ids scored by their
+last activity, trimmed to ONLINE_SECONDS on every write.
+"""
+
+BITMAP_DAYS = 400
+ONLINE_SECONDS = 300
+PENDING_DAYS = "active:pending"
+
+
+def day_key(community_id, day):
+    return "active:%d:%s" % (community_id, day.isoformat())
+
+
+def online_key(community_id):
+    return "online:%d" % community_id
+
+
+def record_activity(person):
+    today = date.today()
+    now = timezone.now().timestamp()
+    pipe = re.pipeline(transaction=False)
+    pipe.setbit(day_key(person.community_id, today), person.id, 1)
+    pipe.expire(day_key(person.community_id, today), BITMAP_DAYS * 24 * 60 * 60)
+    pipe.sadd(PENDING_DAYS, "%d:%s" % (person.community_id, today.isoformat()))
+    pipe.zadd(online_key(person.community_id), {person.id: now})
+    pipe.zremrangebyscore(
+        online_key(person.community_id), "-inf", "(" + str(now - ONLINE_SECONDS)
+    )
+    pipe.execute()
+
+
+def online_ids(community_id):
+    cutoff = timezone.now().timestamp() - ONLINE_SECONDS
+    return [
+        int(m) for m in re.zrangebyscore(online_key(community_id), cutoff, "+inf")
+    ]
+
+
+def daily_active(community_id, day):
+    return re.bitcount(day_key(community_id, day))
+
+
+def active_between(community_id, start, end):
+    """
+    Distinct people active from start to end, inclusive.
+    """
+    keys = [
+        day_key(community_id, start + timedelta(days=i))
+        for i in range((end - start).days + 1)
+    ]
+    dest = "active:union:%d:%s:%s" % (community_id, start, end)
+    pipe = re.pipeline(transaction=True)
+    pipe.bitop("OR", dest, *keys)
+    pipe.bitcount(dest)
+    pipe.delete(dest)
+    return pipe.execute()[1]
+
+
+def _bits(data):
+    return [
+        i * 8 + bit
+        for i, byte in enumerate(data or b"")
+        if byte
+        for bit in range(8)
+        if byte & (0x80 >> bit)
+    ]
+
+
+def finished_days():
+    """
+    Returns [(community_id, day, person_ids)] for days before today that
+    have not been flushed yet.
+    """
+    today = date.today()
+    pending = []
+    for entry in re.smembers(PENDING_DAYS):
+        community_id, day = entry.decode("utf-8").split(":")
+        day = date.fromisoformat(day)
+        if day < today:
+            pending.append((int(community_id), day))
+    pipe = re.pipeline(transaction=False)
+    for community_id, day in pending:
+        pipe.get(day_key(community_id, day))
+    return [
+        (community_id, day, _bits(data))
+        for (community_id, day), data in zip(pending, pipe.execute())
+    ]
+
+
+def mark_flushed(community_id, day):
+    re.srem(PENDING_DAYS, "%d:%s" % (community_id, day.isoformat()))
@@ -0,0 +1,131 @@
+from datetime import datetime
+from django.db import models
+from django.db.models import ExpressionWrapper, F, OuterRef, Subquery, Value
+from django.db.models.functions import (
+    Cast,
+    Extract,
+    Greatest,
+    Least,
+    Log,
+    Now,
+    Power,
+    Sqrt,
+)
+import pytz
+
+"""
+Ranking algorithms. Each one builds a database expression for the score
+column, so rescoring a million rows is one UPDATE instead of a million saves.
+
+Communities pick an algorithm for posts and one for comments. Algorithms in
+VOLATILE move without new votes (age or exposure), so the rescoring job
+recomputes every row in the window for them instead of only rows whose
+points changed.
+"""
+
+EPOCH = datetime(2019, 1, 1, 0, 0, 0, 0, pytz.UTC)
+WILSON_Z = 1.96
+
+
+def _num(value):
+    return Value(value, output_field=models.FloatField())
+
+
+def _float(expression):
+    return Cast(expression, models.FloatField())
+
+
+def _epoch(expression):
+    return _float(Extract(expression, "epoch"))
+
+
+def hot(model, points):
+    """
+    log10(points + 1) plus the post time, so a tenfold lead in points is
+    worth about 12 hours of age.
+    """
+    return Log(_num(10), _float(points + 1)) + (
+        _epoch("posted") - _num(EPOCH.timestamp())
+    ) / _num(60000.0)
+
+
+def top(model, points):
+    return _float(points)
+
+
+def rising(model, points):
+    """
+    Points per hour, with a two hour head start so a single early vote does
+    not put a brand new post on top.
+    """
+    hours = (_epoch(Now()) - _epoch("posted")) / _num(3600.0)
+    return _float(points) / Power(
+        Greatest(hours, _num(0.0)) + _num(2.0), _num(1.5)
+    )
+
+
+def controversial(model, points):
+    """
+    There are no downvotes, so comments stand in for disagreement: posts that
+    are talked about as much as they are upvoted rank highest, scaled by
+    total engagement. Zero when either side is zero.
+    """
+    points = _float(points)
+    talk = _float(F("comment_count"))
+    balance = Least(points, talk) / Greatest(points, talk, _num(1.0))
+    return Power(points + talk, balance) - _num(1.0)
+
+
+def wilson(model, points):
+    """
+    Lower bound of the Wilson score interval for the upvote rate. Posts use
+    their view count as exposure, comments use their post's.
+    """
+    if model._meta.model_name == "post":
+        views = F("views")
+    else:
+        post_model = model._meta.get_field("post").related_model
+        views = Subquery(
+            post_model.objects.filter(pk=OuterRef("post_id")).values("views")[:1]
+        )
+    points = _float(points)
+    n = Greatest(_float(views), points, _num(1.0))
+    p = points / n
+    z2 = _num(WILSON_Z * WILSON_Z)
+    return (
+        p
+        + z2 / (_num(2.0) * n)
+        - _num(WILSON_Z) * Sqrt((p * (_num(1.0) - p) + z2 / (_num(4.0) * n)) / n)
+    ) / (_num(1.0) + z2 / n)
+
+
+POST_ALGORITHMS = {
+    "hot": hot,
+    "top": top,
+    "rising": rising,
+    "controversial": controversial,
+    "wilson": wilson,
+}
+COMMENT_ALGORITHMS = {
+    "top": top,
+    "hot": hot,
+    "rising": rising,
+    "wilson": wilson,
+}
+VOLATILE = {"rising", "wilson"}
+
+POST_CHOICES = [(name, name) for name in POST_ALGORITHMS]
+COMMENT_CHOICES = [(name, name) for name in COMMENT_ALGORITHMS]
+
+
+def expression(model, name, points=None):
+    """
+    points overrides the points column, for computing a score in the same
+    statement that changes it.
+    """
+    if points is None:
+        points = F("points")
+    return ExpressionWrapper(
+        model.RANKING_ALGORITHMS[name](model, points),
+        output_field=models.FloatField(),
+    )
@@ -0,0 +1,92 @@
+import time
+from django.core.cache import cache
+
+"""
+Shared rendering of posts. The viewer-independent JSON of a post (with its
+comment tree, for post detail) is built once and kept in the Django cache;
+the fields that depend on who is looking are merged in afterwards, for the
+whole page at once (see serializers.viewer_overlay).
+
+Each post has a version, bumped when the post, its comments or votes on
+either change, and each community has one for the people, channels and
+settings embedded in the JSON. Entries remember the versions they were
+built at and are rebuilt when either moves.
+"""
+
+KEEP_SECONDS = 24 * 60 * 60
+
+
+def post_version_key(post_id):
+    return "render:version:post:%d" % post_id
+
+
+def community_version_key(community_id):
+    return "render:version:community:%d" % community_id
+
+
+def _entry_key(post_id, variant):
+    return "render:post:%d:%s" % (post_id, variant)
+
+
+def bump_post(post_id):
+    bump_posts([post_id])
+
+
+def bump_posts(post_ids):
+    now = time.time()
+    cache.set_many({post_version_key(post_id): now for post_id in post_ids}, None)
+
+
+def bump_community(community_id):
+    cache.set(community_version_key(community_id), time.time(), None)
+
+
+def _versions(community_id, post_ids):
+    """
+    Current {post_id: [community version, post version]}.
+    """
+    community_key = community_version_key(community_id)
+    keys = [community_key] + [post_version_key(i) for i in post_ids]
+    found = cache.get_many(keys)
+    return {
+        i: [found.get(community_key, 0), found.get(post_version_key(i), 0)]
+        for i in post_ids
+    }
+
+
+def shared_posts(posts, build, variant="basic"):
+    """
+    Returns the shared JSON of each post, in order. build(posts) renders the
+    ones that aren't cached at their current versions, in order.
+    """
+    if not posts:
+        return []
+    versions = _versions(posts[0].community_id, [post.id for post in posts])
+    keys = [_entry_key(post.id, variant) for post in posts]
+    found = cache.get_many(keys)
+    data = {}
+    missing = []
+    for post, key in zip(posts, keys):
+        entry = found.get(key)
+        if entry is not None and entry["version"] == versions[post.id]:
+            data[post.id] = entry["data"]
+        else:
+            missing.append(post)
+    if missing:
+        built = build(missing)
+        cache.set_many(
+            {
+                _entry_key(post.id, variant): {
+                    "version": versions[post.id],
+                    "data": post_data,
+                }
+                for post, post_data in zip(missing, built)
+            },
+            KEEP_SECONDS,
+        )
+        data.update({post.id: post_data for post, post_data in zip(missing, built)})
+    return [dict(data[post.id]) for post in posts]
+
+
+def shared_post(post, build, variant="detail"):
+    return shared_posts([post], lambda posts: [build()], variant)[0]
@@ -0,0 +1,124 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+from django.core.cache import cache
+from rest_framework.response import Response
+
+"""
+Whole-response cache for logged-out readers of public communities, in the
+configured Django cache (Redis in production).
+
+Entries are keyed by host, path and sorted query params, and remember the
+community version they were built at. Model signals bump the version, and
+an entry is fresh until the version moves or FRESH_SECONDS pass. Stale
+entries are kept for KEEP_SECONDS: the first request to find one rebuilds
+it while everyone else keeps getting the stale copy, so a popular page
+going stale costs one rebuild instead of a stampede. On a miss the first
+request builds the entry and the rest wait up to MISS_WAIT_SECONDS for it.
+
+Changes that can take content away from logged-out readers (a community
+going private, channel and room changes, posts moving, deletions) also
+bump the community's access version. An entry built at an older access
+version is never served, not even stale, and a rebuild that doesn't
+return a 200 drops the entry.
+"""
+
+FRESH_SECONDS = 30
+KEEP_SECONDS = 60 * 60
+REFRESH_LOCK_SECONDS = 30
+MISS_WAIT_SECONDS = 2
+MISS_POLL_SECONDS = 0.05
+
+
+def version_key(scope, community_id):
+    return "anon:version:%s:%d" % (scope, community_id)
+
+
+def _response_key(request):
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    raw = "|".join([request.get_host(), request.path, query])
+    return "anon:response:" + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def bump(community_id, scope="community"):
+    cache.set(version_key(scope, community_id), time.time(), None)
+
+
+def bump_access(community_id):
+    cache.set(version_key("access", community_id), time.time(), None)
+
+
+def _hit(entry, on_hit):
+    if on_hit:
+        on_hit(entry["data"])
+    return Response(entry["data"])
+
+
+def _wait_for(key, access):
+    """
+    Polls for the entry another request is building, for up to
+    MISS_WAIT_SECONDS. Returns it, or None if it didn't show up.
+    """
+    deadline = time.time() + MISS_WAIT_SECONDS
+    while time.time() < deadline:
+        time.sleep(MISS_POLL_SECONDS)
+        entry = cache.get(key)
+        if entry is not None and entry.get("access") == access:
+            return entry
+    return None
+
+
+def cached_response(
+    request, community_id, build, scopes=("community",), on_hit=None
+):
+    """
+    Returns build() for signed-in users, and a cached copy of it for
+    everyone else. on_hit(data) runs when the response comes from the cache.
+    """
+    if request.user.is_authenticated or community_id is None:
+        return build()
+
+    key = _response_key(request)
+    lock_key = key + ":refresh"
+    access_key = version_key("access", community_id)
+    version_keys = [version_key(scope, community_id) for scope in scopes]
+    found = cache.get_many(version_keys + [access_key, key])
+    version = [found.get(k, 0) for k in version_keys]
+    access = found.get(access_key, 0)
+    entry = found.get(key)
+    if entry is not None and entry.get("access") != access:
+        entry = None
+    if entry is not None:
+        fresh = entry["version"] == version and entry["expires"] > time.time()
+        if fresh or not cache.add(lock_key, 1, REFRESH_LOCK_SECONDS):
+            return _hit(entry, on_hit)
+    elif not cache.add(lock_key, 1, REFRESH_LOCK_SECONDS):
+        # Another request is building it; wait for its copy, and if that
+        # takes too long, build one without writing it
+        entry = _wait_for(key, access)
+        if entry is not None:
+            return _hit(entry, on_hit)
+        return build()
+
+    try:
+        response = build()
+        if response.status_code == 200:
+            cache.set(
+                key,
+                {
+                    "version": version,
+                    "access": access,
+                    "expires": time.time() + FRESH_SECONDS,
+                    "data": response.data,
+                },
+                KEEP_SECONDS,
+            )
+        else:
+            cache.delete(key)
+    except Exception:
+        cache.delete(key)
+        raise
+    finally:
+        # Only once the entry is written, so waiters find it
+        cache.delete(lock_key)
+    return response
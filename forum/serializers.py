@@ -11,16 +11,49 @@ from .models import (
     ChatRoom,
     CustomField,
     CustomFieldValue,
+    last_read_ids,
 )
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import models
 from django.contrib.auth.models import User
-from rest_framework_recursive.fields import RecursiveField
-from django.utils.html import strip_tags
+from django.utils.html import escape, strip_tags
+from .comment_tree import CommentTree
+from . import community_cache, ranking
 
 
 def _get_vote(self, obj):
     person = self.context.get("person", False)
-    return obj.user_vote(person) if person else False
+    if not person:
+        return False
+    votes = self.context.get("votes", {})
+    if (type(obj), obj.id) in votes:
+        return votes[(type(obj), obj.id)]
+    return obj.user_vote(person)
+
+
+def _prefetch_votes(self, objs):
+    person = self.context.get("person", False)
+    if not person or not objs:
+        return
+    model = type(objs[0])
+    votes = self.context.setdefault("votes", {})
+    objs = [obj for obj in objs if (model, obj.id) not in votes]
+    if not objs:
+        return
+    voted = model.voted_ids(person, [obj.id for obj in objs])
+    for obj in objs:
+        votes[(model, obj.id)] = obj.id in voted
+
+
+def _comment_tree(self, post):
+    tree = self.context.get("comment_tree")
+    if tree is None or tree.post.id != post.id:
+        tree = CommentTree(post)
+        self.context["comment_tree"] = tree
+    if not tree.votes_prefetched:
+        _prefetch_votes(self, tree.comments)
+        tree.votes_prefetched = True
+    return tree
 
 
 def _get_editable(self, obj):
@@ -28,6 +61,59 @@ def _get_editable(self, obj):
     return obj.can_edit(person) if person else False
 
 
+class ScoredListSerializer(serializers.ListSerializer):
+    """
+    Fetches the viewer's votes for the whole list in one query.
+    """
+
+    def to_representation(self, data):
+        objs = list(data.all() if isinstance(data, models.Manager) else data)
+        _prefetch_votes(self, objs)
+        return super().to_representation(objs)
+
+
+def _comments_in(comments):
+    for comment in comments:
+        yield comment
+        yield from _comments_in(comment.get("children") or [])
+
+
+def viewer_overlay(person, community_id, posts):
+    """
+    Fills in vote and editable on shared post JSON rendered without a
+    viewer (see render.py), and on the comments in it, with one vote query
+    per model.
+    """
+    comments = [c for post in posts for c in _comments_in(post.get("comments") or [])]
+    for model, items in ((Post, posts), (Comment, comments)):
+        voted = set()
+        if person and items:
+            voted = model.voted_ids(person, [item["id"] for item in items])
+        for item in items:
+            item["vote"] = item["id"] in voted
+            item["editable"] = bool(person) and (
+                (item.get("owner") or {}).get("id") == person.id
+                or (person.admin and person.community_id == community_id)
+            )
+    return posts
+
+
+class ContentModeMixin:
+    """
+    Renders content as context["content"] asks (see utils.content_mode):
+    in full, as the stored plaintext excerpt, or not at all.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        mode = self.context.get("content", "full")
+        if mode == "none":
+            fields.pop("content", None)
+        elif mode == "excerpt" and "content" in fields:
+            fields["content"] = serializers.CharField(source="excerpt", read_only=True)
+        return fields
+
+
 def _validate_content(self, value):
     if len(strip_tags(value).strip()) <= 0:
         raise serializers.ValidationError("Content must not be blank")
@@ -109,26 +195,22 @@ class CustomFieldSerializer(serializers.ModelSerializer):
         fields = ("id", "name")
 
 
-class CommunitySerializer(serializers.ModelSerializer):
-    channels = serializers.SerializerMethodField()
+class CommunitySettingsSerializer(serializers.ModelSerializer):
+    """
+    Everything in CommunitySerializer that's the same for every viewer.
+    """
+
     name = serializers.CharField(min_length=4, max_length=100)
     admins = BasicPersonSerializer(many=True)
     links = LinkSerializer(many=True)
     chatrooms = BasicChatRoomSerializer(many=True)
     custom_fields = CustomFieldSerializer(many=True)
 
-    def get_channels(self, obj):
-        viewer = self.context.get("person", None)
-        return BasicChannelSerializer(
-            obj.allowed_channels(viewer).order_by("sort"), many=True
-        ).data
-
     class Meta:
         model = Community
         fields = (
             "name",
             "private",
-            "channels",
             "chatrooms",
             "id",
             "custom_stylesheet",
@@ -148,11 +230,12 @@ class CommunitySerializer(serializers.ModelSerializer):
             "custom_fields",
             "login_redirect",
             "logout_redirect",
+            "post_ranking",
+            "comment_ranking",
         )
         read_only_fields = (
             "name",
             "private",
-            "channels",
             "display_name",
             "custom_header",
             "chatrooms",
@@ -172,9 +255,28 @@ class CommunitySerializer(serializers.ModelSerializer):
             "custom_fields",
             "login_redirect",
             "logout_redirect",
+            "post_ranking",
+            "comment_ranking",
         )
 
 
+class CommunitySerializer(serializers.BaseSerializer):
+    """
+    Community settings from community_cache, plus the channels the viewer
+    can see.
+    """
+
+    def to_representation(self, obj):
+        viewer = self.context.get("person", None)
+        data = community_cache.get(
+            obj.id, lambda: CommunitySettingsSerializer(obj).data
+        )
+        data["channels"] = BasicChannelSerializer(
+            obj.allowed_channels(viewer).order_by("sort"), many=True
+        ).data
+        return data
+
+
 class CommunityEditSerializer(serializers.Serializer):
     channels = BasicChannelSerializer(many=True)
     links = LinkSerializer(many=True)
@@ -201,6 +303,12 @@ class CommunityEditSerializer(serializers.Serializer):
     )
 
     track_anonymous = serializers.BooleanField(required=False)
+    post_ranking = serializers.ChoiceField(
+        choices=ranking.POST_CHOICES, required=False
+    )
+    comment_ranking = serializers.ChoiceField(
+        choices=ranking.COMMENT_CHOICES, required=False
+    )
 
 
 class CustomFieldValueSerializer(serializers.ModelSerializer):
@@ -224,10 +332,18 @@ class PersonSerializer(serializers.ModelSerializer):
         return _get_editable(self, obj)
 
     def get_posts(self, obj):
-        return BasicPostSerializer(self.context.get("posts", []), many=True).data
+        return BasicPostSerializer(
+            self.context.get("posts", []),
+            many=True,
+            context={"content": self.context.get("content", "full")},
+        ).data
 
     def get_comments(self, obj):
-        return BasicCommentSerializer(self.context.get("comments", []), many=True).data
+        return BasicCommentSerializer(
+            self.context.get("comments", []),
+            many=True,
+            context={"content": self.context.get("content", "full")},
+        ).data
 
     class Meta:
         model = Person
@@ -283,16 +399,52 @@ class CommentSerializer(serializers.ModelSerializer):
     points = serializers.IntegerField(read_only=True)
     vote = serializers.SerializerMethodField()
     editable = serializers.SerializerMethodField()
-    children = RecursiveField(many=True, required=False)
+    children = serializers.SerializerMethodField()
+    more_children = serializers.SerializerMethodField()
+
+    def _tree(self, obj):
+        tree = self.context.get("comment_tree")
+        if tree is None or tree.post.id != obj.post_id:
+            return None
+        return _comment_tree(self, tree.post)
+
+    def _depth(self):
+        return self.context.get("comment_depth", 1)
+
+    def _depth_reached(self, tree):
+        return tree.max_depth is not None and self._depth() >= tree.max_depth
 
     def get_vote(self, obj):
+        self._tree(obj)
         return _get_vote(self, obj)
 
     def get_editable(self, obj):
         return _get_editable(self, obj)
 
+    def get_children(self, obj):
+        tree = self._tree(obj)
+        if tree is None:
+            children = obj.children.select_related("owner")
+            return CommentSerializer(children, many=True, context=self.context).data
+        if self._depth_reached(tree):
+            return []
+        return CommentSerializer(
+            tree.children(obj.id),
+            many=True,
+            context={**self.context, "comment_depth": self._depth() + 1},
+        ).data
+
+    def get_more_children(self, obj):
+        tree = self._tree(obj)
+        if tree is None:
+            return None
+        if self._depth_reached(tree):
+            return tree.more(obj.id, 0)
+        return tree.more(obj.id, len(tree.children(obj.id)))
+
     class Meta:
         model = Comment
+        list_serializer_class = ScoredListSerializer
         fields = (
             "id",
             "owner",
@@ -300,12 +452,13 @@ class CommentSerializer(serializers.ModelSerializer):
             "vote",
             "editable",
             "children",
+            "more_children",
             "posted",
             "content",
         )
 
 
-class BasicPostSerializer(serializers.ModelSerializer):
+class BasicPostSerializer(ContentModeMixin, serializers.ModelSerializer):
     owner = BasicPersonSerializer()
     num_comments = serializers.IntegerField(read_only=True)
     points = serializers.IntegerField(read_only=True)
@@ -321,6 +474,7 @@ class BasicPostSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Post
+        list_serializer_class = ScoredListSerializer
         fields = (
             "id",
             "owner",
@@ -357,7 +511,7 @@ class MinimalPostSerializer(serializers.ModelSerializer):
         fields = ("title", "id")
 
 
-class BasicCommentSerializer(serializers.ModelSerializer):
+class BasicCommentSerializer(ContentModeMixin, serializers.ModelSerializer):
     post = MinimalPostSerializer()
 
     class Meta:
@@ -367,7 +521,8 @@ class BasicCommentSerializer(serializers.ModelSerializer):
 
 class PostSerializer(serializers.ModelSerializer):
     owner = BasicPersonSerializer()
-    comments = CommentSerializer(many=True)
+    comments = serializers.SerializerMethodField()
+    more_comments = serializers.SerializerMethodField()
     points = serializers.IntegerField(read_only=True)
     vote = serializers.SerializerMethodField()
     editable = serializers.SerializerMethodField()
@@ -379,12 +534,23 @@ class PostSerializer(serializers.ModelSerializer):
     def get_editable(self, obj):
         return _get_editable(self, obj)
 
+    def get_comments(self, obj):
+        tree = _comment_tree(self, obj)
+        return CommentSerializer(
+            tree.children(None), many=True, context=self.context
+        ).data
+
+    def get_more_comments(self, obj):
+        tree = _comment_tree(self, obj)
+        return tree.more(None, len(tree.children(None)))
+
     class Meta:
         model = Post
         fields = (
             "id",
             "owner",
             "comments",
+            "more_comments",
             "points",
             "vote",
             "pinned",
@@ -399,6 +565,7 @@ class PostSerializer(serializers.ModelSerializer):
             "id",
             "owner",
             "comments",
+            "more_comments",
             "pinned",
             "points",
             "vote",
@@ -568,6 +735,21 @@ class MessageSerializer(serializers.ModelSerializer):
         read_only_fields = ("id", "message", "sender", "posted", "room")
 
 
+class MessageSearchSerializer(MessageSerializer):
+    snippet = serializers.SerializerMethodField()
+
+    def get_snippet(self, obj):
+        # HTML: the message text escaped, with matches in <mark>
+        return (
+            escape(obj.snippet)
+            .replace(Message.HIGHLIGHT_START, "<mark>")
+            .replace(Message.HIGHLIGHT_STOP, "</mark>")
+        )
+
+    class Meta(MessageSerializer.Meta):
+        fields = MessageSerializer.Meta.fields + ("snippet",)
+
+
 class ChatRoomSerializer(serializers.ModelSerializer):
     members = serializers.SerializerMethodField()
     last_message = MessageSerializer()
@@ -575,19 +757,19 @@ class ChatRoomSerializer(serializers.ModelSerializer):
 
     def get_unread(self, obj):
         viewer = self.context.get("person", None)
-        if not obj.last_message:
+        if not obj.last_message_id or not viewer:
             return False
-        if viewer:
-            metadata = obj.persons_metadata.filter(person=viewer).first()
-            if metadata and metadata.last_read:
-                return (
-                    obj.last_message.sender.id != viewer.id
-                    and obj.last_message.id != metadata.last_read.id
-                )
-            else:
-                return True
-
-        return False
+        # ChatRoomList passes every room's last read at once
+        reads = self.context.get("last_read")
+        if reads is None:
+            reads = last_read_ids(viewer.id, [obj.id])
+        last_read = reads.get(obj.id)
+        if last_read is None:
+            return True
+        return (
+            obj.last_message.sender_id != viewer.id
+            and obj.last_message_id != last_read
+        )
 
     def get_members(self, obj):
         if obj.room_type == ChatRoom.DIRECT:
@@ -642,6 +824,17 @@ class ChatRoomCreateSerializer(serializers.ModelSerializer):
         fields = ("id", "private_members", "private", "name")
 
 
+class NotificationListSerializer(serializers.ListSerializer):
+    """
+    Fetches the viewer's votes on the notifications' posts in one query.
+    """
+
+    def to_representation(self, data):
+        objs = list(data.all() if isinstance(data, models.Manager) else data)
+        _prefetch_votes(self, [obj.target_post for obj in objs if obj.target_post])
+        return super().to_representation(objs)
+
+
 class NotificationSerializer(serializers.ModelSerializer):
     action_taker = BasicPersonSerializer()
     target_post = BasicPostSerializer()
@@ -653,6 +846,7 @@ class NotificationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Notification
+        list_serializer_class = NotificationListSerializer
         fields = (
             "read",
             "action_taker",
@@ -1,3 +1,274 @@
-from django.test import TestCase
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import Http404
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from . import access, conditional
+from .models import ChatRoom, Channel, Comment, Community, Message, Person, Post
 
-# Create your tests here.
+
+class CommunityTestCase(TestCase):
+    """
+    A community named NAME with PEOPLE members, the first of them an admin
+    if FIRST_ADMIN, and the Algolia indexes stubbed out.
+    """
+
+    NAME = None
+    PEOPLE = 3
+    FIRST_ADMIN = False
+
+    def setUp(self):
+        for target in ("forum.models.index", "forum.models.person_index"):
+            patcher = mock.patch(target, mock.MagicMock())
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cache.clear()
+        self.community = Community.objects.create(name=self.NAME)
+        self.people = []
+        for i in range(self.PEOPLE):
+            user = User.objects.create_user(username="%s%d" % (self.NAME, i))
+            self.people.append(
+                Person.objects.create(
+                    user=user,
+                    community=self.community,
+                    email="%s%d@example.com" % (self.NAME, i),
+                    username="person%d" % i,
+                    admin=self.FIRST_ADMIN and i == 0,
+                )
+            )
+        self.channel = Channel.objects.filter(community=self.community).first()
+
+    def client_for(self, person):
+        client = APIClient()
+        client.force_authenticate(user=person.user)
+        return client
+
+    def assertQueries(self, num, path, person=None):
+        """
+        Asserts path takes num queries for person (people[1] by default),
+        once their access context is cached.
+        """
+        client = self.client_for(person or self.people[1])
+        client.get(path)
+        with self.assertNumQueries(num):
+            response = client.get(path)
+        self.assertEqual(response.status_code, 200)
+
+
+class DetailQueryCountTest(CommunityTestCase):
+    """
+    Query counts of the detail endpoints for a signed-in member.
+    """
+
+    NAME = "querycount"
+    FIRST_ADMIN = True
+
+    def setUp(self):
+        super().setUp()
+        access.invalidate_people([p.id for p in self.people])
+        self.private = Channel.objects.create(
+            community=self.community, name="private", emoji="x", private=True
+        )
+        self.private.private_members.add(self.people[1])
+        self.post = Post.objects.create(
+            owner=self.people[1], channel=self.channel, title="post", content="post"
+        )
+        self.private_post = Post.objects.create(
+            owner=self.people[1], channel=self.private, title="post", content="post"
+        )
+        self.comment = Comment.objects.create(
+            post=self.post, owner=self.people[2], content="comment"
+        )
+        Comment.objects.create(
+            post=self.post, owner=self.people[1], content="reply", parent=self.comment
+        )
+
+    def test_post_detail(self):
+        # post with community, channel and owner; post vote; comment votes.
+        # The comments themselves come from the shared rendering.
+        self.assertQueries(3, "/v1/post/%d" % self.post.id)
+
+    def test_private_post_detail(self):
+        # no comments, so no comment votes
+        self.assertQueries(2, "/v1/post/%d" % self.private_post.id)
+
+    def test_comment_detail(self):
+        # comment with post, community, channel and owner; thread; votes
+        self.assertQueries(3, "/v1/comment/%d" % self.comment.id)
+
+    def test_person_detail(self):
+        # person with community; posts; comments; custom fields
+        self.assertQueries(4, "/v1/_person/%d" % self.people[2].id)
+
+    def test_channel_detail(self):
+        # channel with community; private members
+        self.assertQueries(2, "/v1/channel/%d" % self.private.id)
+
+    def test_community_post_list(self):
+        # community; posts with owner and channel; votes
+        self.assertQueries(3, "/v1/community/querycount.comradery.io/posts?cursor=")
+
+
+class ChatRoomListTest(CommunityTestCase):
+    NAME = "chatroomlist"
+
+    def test_query_count(self):
+        # rooms with last message and sender; DM members; reads
+        for i in range(3):
+            room = ChatRoom.objects.create(
+                community=self.community, room_type=ChatRoom.DIRECT
+            )
+            room.private_members.add(self.people[1], self.people[2])
+            Message.objects.create(sender=self.people[2], room=room, message="dm")
+            room = ChatRoom.objects.create(
+                community=self.community, room_type=ChatRoom.ROOM, private=False
+            )
+            Message.objects.create(sender=self.people[0], room=room, message="hi")
+        self.assertQueries(3, "/v1/community/chatroomlist.comradery.io/chatrooms")
+
+
+class BootstrapTest(CommunityTestCase):
+    NAME = "bootstrap"
+
+    def test_part_fails(self):
+        Post.objects.create(
+            owner=self.people[1], channel=self.channel, title="post", content="post"
+        )
+        with mock.patch("forum.views.ChannelList._get", side_effect=Http404):
+            response = self.client_for(self.people[1]).get(
+                "/v1/community/bootstrap.comradery.io/bootstrap",
+                {"include": "channels,posts"},
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data["channels"])
+        self.assertEqual(response.data["status"], {"channels": 404, "posts": 200})
+        self.assertEqual(len(response.data["posts"]["data"]), 1)
+
+
+class SharedRenderTest(CommunityTestCase):
+    """
+    Post JSON is shared between viewers, with vote and editable per viewer.
+    """
+
+    NAME = "sharedrender"
+    PEOPLE = 2
+
+    def setUp(self):
+        super().setUp()
+        self.post = Post.objects.create(
+            owner=self.people[0], channel=self.channel, title="post", content="post"
+        )
+        self.comment = Comment.objects.create(
+            post=self.post, owner=self.people[1], content="comment"
+        )
+
+    def get(self, person):
+        return self.client_for(person).get("/v1/post/%d" % self.post.id).data
+
+    def test_viewer_fields(self):
+        self.comment.add_vote(self.people[0])
+        first, second = self.get(self.people[0]), self.get(self.people[1])
+        self.assertEqual((first["editable"], second["editable"]), (True, False))
+        comments = first["comments"][0], second["comments"][0]
+        self.assertEqual([c["vote"] for c in comments], [True, False])
+        self.assertEqual([c["editable"] for c in comments], [False, True])
+        self.assertEqual([c["points"] for c in comments], [1, 1])
+
+    def test_changes(self):
+        self.get(self.people[0])
+        Comment.objects.create(post=self.post, owner=self.people[0], content="new")
+        self.assertEqual(len(self.get(self.people[1])["comments"]), 2)
+        self.post.add_vote(self.people[1])
+        data = self.get(self.people[1])
+        self.assertEqual((data["points"], data["vote"]), (1, True))
+
+    def test_deleted_comment_with_replies(self):
+        Comment.objects.create(
+            post=self.post, owner=self.people[0], content="reply", parent=self.comment
+        )
+        self.assertFalse(self.comment.user_delete())
+        data = self.get(self.people[1])
+        deleted = data["comments"][0]
+        self.assertEqual((deleted["owner"], deleted["editable"]), (None, False))
+        self.assertFalse(deleted["children"][0]["editable"])
+
+
+@override_settings(SURROGATE_PURGE_BACKEND="forum.conditional.RecordingPurge")
+class ConditionalGetTest(CommunityTestCase):
+    NAME = "conditional"
+    PEOPLE = 1
+
+    def setUp(self):
+        super().setUp()
+        conditional.RecordingPurge.purged.clear()
+        self.person = self.people[0]
+        self.post = Post.objects.create(
+            owner=self.person, channel=self.channel, title="post", content="post"
+        )
+        self.client = self.client_for(self.person)
+        self.path = "/v1/post/%d" % self.post.id
+
+    def test_not_modified(self):
+        etag = self.client.get(self.path)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes(self):
+        etag = self.client.get(self.path)["ETag"]
+        with mock.patch("django.db.transaction.on_commit", lambda f: f()):
+            Comment.objects.create(post=self.post, owner=self.person, content="x")
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("post-%d" % self.post.id, conditional.RecordingPurge.purged)
+
+    def test_self_channel_renamed(self):
+        etag = self.client.get("/v1/self")["ETag"]
+        with mock.patch("django.db.transaction.on_commit", lambda f: f()):
+            Channel.objects.filter(community=self.community).first().save()
+        response = self.client.get("/v1/self", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_no_last_modified(self):
+        response = self.client.get(self.path)
+        self.assertNotIn("Last-Modified", response)
+        with mock.patch("django.db.transaction.on_commit", lambda f: f()):
+            Comment.objects.create(post=self.post, owner=self.person, content="x")
+        response = self.client.get(
+            self.path, HTTP_IF_MODIFIED_SINCE="Fri, 01 Jan 2100 00:00:00 GMT"
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class ChatSearchTest(CommunityTestCase):
+    NAME = "chatsearch"
+
+    def setUp(self):
+        super().setUp()
+        room = ChatRoom.objects.create(
+            community=self.community, room_type=ChatRoom.ROOM, private=False
+        )
+        dm, _ = ChatRoom.open_direct(self.community, self.people[:2])
+        Message.objects.create(sender=self.people[0], room=room, message="1 < 2 deploy")
+        Message.objects.create(sender=self.people[0], room=dm, message="deploying")
+
+    def search(self, person, text):
+        return self.client_for(person).get(
+            "/v1/community/chatsearch.comradery.io/chat/search", {"q": text}
+        ).data["data"]
+
+    def test_scoped_to_viewer(self):
+        self.assertEqual(len(self.search(self.people[1], "deploy")), 2)
+        self.assertEqual(len(self.search(self.people[2], "deploy")), 1)
+
+    def test_snippet_escaped(self):
+        snippet = self.search(self.people[2], "deploy")[0]["snippet"]
+        self.assertEqual(snippet, "1 &lt; 2 <mark>deploy</mark>")
+
+    def test_edits_reindexed(self):
+        message = Message.objects.get(message="deploying")
+        message.message = "rollback"
+        message.save(update_fields=["message"])
+        self.assertEqual(len(self.search(self.people[1], "rollback")), 1)
+        self.assertEqual(len(self.search(self.people[1], "deploy")), 1)
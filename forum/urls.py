@@ -15,6 +15,11 @@ urlpatterns = [
         views.CommunityPrivacy.as_view(),
         name="community_privacy",
     ),
+    path(
+        "community/<str:community_url>/bootstrap",
+        views.Bootstrap.as_view(),
+        name="community_bootstrap",
+    ),
     path(
         "community/<str:community_url>/search_key",
         views.SearchKey.as_view(),
@@ -59,6 +64,11 @@ urlpatterns = [
         views.CommentCreate.as_view(),
         name="comment_create",
     ),
+    path(
+        "post/<int:post_id>/comments",
+        views.PostComments.as_view(),
+        name="post_comments",
+    ),
     path("post/<int:post_id>/pin", views.PinPost.as_view(), name="pin_post"),
     path(
         "post/upload_file/<str:filename>",
@@ -101,6 +111,16 @@ urlpatterns = [
         views.ChatRoomList.as_view(),
         name="chatroom_list",
     ),
+    path(
+        "community/<str:community_url>/chat/events",
+        views.ChatEvents.as_view(),
+        name="chat_events",
+    ),
+    path(
+        "community/<str:community_url>/chat/search",
+        views.ChatSearch.as_view(),
+        name="chat_search",
+    ),
     path(
         "chatrooms/<int:room_id>/messages",
         views.ChatRoomMessages.as_view(),
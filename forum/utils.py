@@ -3,17 +3,21 @@ from django.core.exceptions import (
     PermissionDenied,
     ObjectDoesNotExist,
     SuspiciousOperation,
+    ValidationError,
 )
 import os
 import analytics
 import base64
+import json
 import uuid
 from rest_framework.response import Response
 from rest_framework import status
 from lxml.html.clean import Cleaner  # pylint: disable=no-name-in-module
-from lxml import html
+from lxml import etree, html
 from django.core.paginator import Paginator
+from django.db import connection
 from django.conf import settings
+from . import identity
 
 
 def in_prod():
@@ -42,9 +46,13 @@ def frontend_url():
 
 
 def _get_object(_cls, obj_id):
-    try:
-        obj = _cls.objects.get(id=obj_id)
+    obj = identity.get(_cls, obj_id)
+    if obj is not None:
         return obj
+    try:
+        related = getattr(_cls, "DETAIL_RELATED", ())
+        obj = _cls.objects.select_related(*related).get(id=obj_id)
+        return identity.add(obj)
     except ObjectDoesNotExist:
         raise Http404()
 
@@ -90,13 +98,13 @@ def viewer_edit_object(_cls, obj_id, viewer):
 
 
 def common_get_object(obj, viewer):
-    return obj.community.people.filter(id=viewer.id).exists()
+    return obj.community_id == viewer.community_id
 
 
 def common_edit_object(obj, viewer):
-    if hasattr(obj, "owner") and obj.owner and obj.owner.id == viewer.id:
+    if getattr(obj, "owner_id", None) == viewer.id:
         return True
-    return obj.community.people.filter(id=viewer.id, admin=True).exists()
+    return viewer.admin and viewer.community_id == obj.community_id
 
 
 def serializer_check(serializer):
@@ -111,16 +119,54 @@ def person_context(request):
     return {"person": None}
 
 
+CONTENT_MODES = ("full", "excerpt", "none")
+
+
+def content_mode(request):
+    """
+    ?content= on list endpoints: full bodies (the default), plaintext
+    excerpts, or none at all.
+    """
+    mode = request.query_params.get("content", "full")
+    if mode not in CONTENT_MODES:
+        raise SuspiciousOperation("content must be one of " + ", ".join(CONTENT_MODES))
+    return mode
+
+
+def list_context(request):
+    return {**person_context(request), "content": content_mode(request)}
+
+
+def requested_fields(request):
+    """
+    ?fields= on list endpoints: a comma separated list of the fields to
+    return for each item, or None for all of them.
+    """
+    fields = request.query_params.get("fields")
+    return set(fields.split(",")) if fields else None
+
+
+def select_fields(data, fields):
+    """
+    Keeps only fields of an item, or of each item of a list.
+    """
+    if fields is None:
+        return data
+    if isinstance(data, dict):
+        return {k: v for k, v in data.items() if k in fields}
+    return [select_fields(item, fields) for item in data]
+
+
 def superadmin_api_check(request):
     if request.user.is_authenticated and request.user.person.superadmin_api_only:
         return True
     raise PermissionDenied
 
 
-def generate_filter_string(restricted_channels):
+def generate_filter_string(channel_ids):
     filter_string = ""
-    for rc in restricted_channels:
-        filter_string += "channel_id:" + str(rc.id) + " OR "
+    for channel_id in channel_ids:
+        filter_string += "channel_id:" + str(channel_id) + " OR "
     if len(filter_string) > 0:
         filter_string = " AND (type:person OR " + filter_string[:-4] + ")"
     return filter_string
@@ -165,6 +211,26 @@ def sanitize_html(_html):
     return c.clean_html(_html)
 
 
+TEXT_BREAKS = ("br", "p", "div", "li", "h1", "h2", "h3", "h4", "h5", "h6", "pre")
+
+
+def html_to_text(content):
+    """
+    The text of (sanitized) HTML, with whitespace collapsed and a space
+    between blocks.
+    """
+    if not content.strip():
+        return ""
+    try:
+        doc = html.fromstring(content)
+    except etree.ParserError:
+        # Nothing but comments or whitespace
+        return ""
+    for el in doc.iter(*TEXT_BREAKS):
+        el.tail = " " + (el.tail or "")
+    return " ".join(doc.text_content().split())
+
+
 def get_page_info(page, objs, step=10):
     paginator = Paginator(objs, step)
     paged_objs = paginator.get_page(page)
@@ -174,3 +240,104 @@ def get_page_info(page, objs, step=10):
         "has_previous": paged_objs.has_previous(),
     }
     return (paged_objs, page_info)
+
+
+def encode_cursor(values):
+    data = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").strip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, TypeError):
+        raise SuspiciousOperation("Invalid cursor")
+    if not isinstance(values, list):
+        raise SuspiciousOperation("Invalid cursor")
+    return values
+
+
+def _cursor_keys(objs):
+    keys = []
+    for order in objs.query.order_by:
+        if not isinstance(order, str) or "__" in order:
+            raise ValueError("Cursor pagination needs plain field orderings")
+        desc = order.startswith("-")
+        name = order.lstrip("-")
+        keys.append((objs.model._meta.pk.name if name == "pk" else name, desc))
+    if not any(name == objs.model._meta.pk.name for name, _ in keys):
+        desc = keys[-1][1] if keys else True
+        keys.append((objs.model._meta.pk.name, desc))
+    if len(set(desc for _, desc in keys)) > 1:
+        raise ValueError("Cursor pagination needs orderings in one direction")
+    return keys
+
+
+def _cursor_value(obj, name):
+    value = getattr(obj, name)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def get_cursor_page(cursor, objs, step=10):
+    """
+    Keyset pagination over the queryset's own ordering. The cursor encodes
+    the sort key and id of the last row on the page, so every page is an
+    indexed range scan and nothing is counted.
+    """
+    keys = _cursor_keys(objs)
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(keys) or None in values:
+            raise SuspiciousOperation("Invalid cursor")
+        fields = [objs.model._meta.get_field(name) for name, _ in keys]
+        try:
+            values = [f.to_python(v) for f, v in zip(fields, values)]
+        except (ValidationError, TypeError, ValueError):
+            raise SuspiciousOperation("Invalid cursor")
+        # A row comparison, which Postgres answers with one index range
+        columns = ", ".join(
+            "%s.%s"
+            % (
+                connection.ops.quote_name(objs.model._meta.db_table),
+                connection.ops.quote_name(f.column),
+            )
+            for f in fields
+        )
+        placeholders = ", ".join(["%s"] * len(values))
+        objs = objs.extra(
+            where=[
+                "(%s) %s (%s)"
+                % (columns, "<" if keys[0][1] else ">", placeholders)
+            ],
+            params=values,
+        )
+
+    ordering = [("-" if desc else "") + name for name, desc in keys]
+    rows = list(objs.order_by(*ordering)[: step + 1])
+    has_next = len(rows) > step
+    rows = rows[:step]
+    page_info = {
+        "cursor": encode_cursor([_cursor_value(rows[-1], name) for name, _ in keys])
+        if has_next
+        else None,
+        "has_next": has_next,
+        "has_previous": bool(cursor),
+    }
+    return (rows, page_info)
+
+
+def wants_cursor(request):
+    """
+    Clients opt in to cursor pages by sending cursor, empty for the first
+    page; everyone else keeps getting page numbers as the cursor.
+    """
+    return "cursor" in request.query_params
+
+
+def paginate(request, objs, step=10):
+    if wants_cursor(request):
+        return get_cursor_page(request.query_params["cursor"], objs, step)
+    return get_page_info(request.query_params.get("page", 1), objs, step)
@@ -0,0 +1,59 @@
+from datetime import date
+from .xredis import re
+
+"""
+Write-behind post view counting. Reads only touch Redis: a hash of pending
+view counts per post, and a set of "<date>:<post_id>:<person_id>" members
+for the per-day unique viewers that become UserPostView rows. cron.py
+--flush-views applies both to the database in bulk.
+"""
+
+PENDING_VIEWS = "views:pending"
+PENDING_VIEWERS = "views:viewers"
+
+
+def record_view(post_id, person_id=None):
+    """
+    Returns the number of views of the post not yet flushed, including
+    this one.
+    """
+    pipe = re.pipeline(transaction=False)
+    pipe.hincrby(PENDING_VIEWS, post_id, 1)
+    if person_id is not None:
+        pipe.sadd(
+            PENDING_VIEWERS,
+            "%s:%d:%d" % (date.today().isoformat(), post_id, person_id),
+        )
+    return pipe.execute()[0]
+
+
+def take_pending():
+    """
+    Atomically takes everything recorded so far. Returns ({post_id: views},
+    [(date, post_id, person_id)]).
+    """
+    pipe = re.pipeline(transaction=True)
+    pipe.hgetall(PENDING_VIEWS)
+    pipe.smembers(PENDING_VIEWERS)
+    pipe.delete(PENDING_VIEWS, PENDING_VIEWERS)
+    views, viewers, _ = pipe.execute()
+    counts = {int(post_id): int(n) for post_id, n in views.items()}
+    rows = []
+    for viewer in viewers:
+        day, post_id, person_id = viewer.decode("utf-8").split(":")
+        rows.append((date.fromisoformat(day), int(post_id), int(person_id)))
+    return counts, rows
+
+
+def restore_pending(counts, rows):
+    """
+    Puts back what take_pending returned, for when the flush fails.
+    """
+    pipe = re.pipeline(transaction=False)
+    for post_id, n in counts.items():
+        pipe.hincrby(PENDING_VIEWS, post_id, n)
+    for day, post_id, person_id in rows:
+        pipe.sadd(
+            PENDING_VIEWERS, "%s:%d:%d" % (day.isoformat(), post_id, person_id)
+        )
+    pipe.execute()
@@ -30,8 +30,27 @@ import uuid
 import os
 import json
 import django_rq
-from .jobs import comment_created, object_liked, post_created
-from .xredis import re_publish, re_get, re_set
+from .jobs import (
+    comment_created,
+    object_liked,
+    post_created,
+    rebuild_community_feeds,
+    rescore_community_job,
+)
+from . import (
+    access,
+    chat_events,
+    chat_reads,
+    community_cache,
+    conditional,
+    feeds,
+    presence,
+    render,
+    response_cache,
+)
+from .view_counts import record_view
+from .xredis import re_get, re_set
+from .comment_tree import CommentTree, parse_limit
 from sentry_sdk import capture_exception
 from postmark.core import PMMail
 from google.oauth2 import id_token
@@ -262,10 +281,13 @@ class SearchKey(APIView):
     def get(self, request, community_url):
         community_id = Community.id_from_host(community_url)
         community = get_object(Community, community_id, request)
-        if request.user.is_authenticated:
-            allowed_channels = community.allowed_channels(request.user.person)
+        person = request.user.person if request.user.is_authenticated else None
+        if person and person.community_id == community.id:
+            allowed_channels = person.viewer_context().allowed_channel_ids()
         else:
-            allowed_channels = community.allowed_channels(None)
+            allowed_channels = community.allowed_channels(person).values_list(
+                "id", flat=True
+            )
         rc_filter_string = generate_filter_string(allowed_channels)
         print(rc_filter_string)
         key = client.generate_secured_api_key(
@@ -280,8 +302,12 @@ class Self(APIView):
 
     def get(self, request):
         person = request.user.person
-        serializer = SelfSerializer(person)
-        return Response(serializer.data)
+        # Private channels and community settings are part of the body
+        return conditional.conditional_response(
+            request,
+            [render.community_version_key(person.community_id)],
+            lambda: Response(SelfSerializer(person).data),
+        )
 
 
 class CommunityList(APIView):
@@ -386,12 +412,7 @@ class CommunityCreate(APIView):
         )
         u_person.save()
 
-        new_room = ChatRoom(
-            private=True, room_type=ChatRoom.DIRECT, community=community,
-        )
-        new_room.save()
-        new_room.private_members.add(person)
-        new_room.private_members.add(u_person)
+        new_room, _ = ChatRoom.open_direct(community, [person, u_person])
 
         message = Message.objects.create(
             sender=person,
@@ -431,6 +452,22 @@ class CommunityDetail(APIView):
 
     def get(self, request, community_url):
         community_id = Community.id_from_host(community_url)
+        return conditional.conditional_response(
+            request,
+            [
+                render.community_version_key(community_id),
+                response_cache.version_key("chat", community_id),
+            ],
+            lambda: response_cache.cached_response(
+                request, community_id, lambda: self._get(request, community_id)
+            ),
+            surrogate_keys=[
+                conditional.community_key(community_id),
+                conditional.chat_key(community_id),
+            ],
+        )
+
+    def _get(self, request, community_id):
         try:
             community = get_object(Community, community_id, request)
             serializer = CommunitySerializer(community, context=person_context(request))
@@ -482,7 +519,16 @@ class CommunityDetail(APIView):
         if "custom_header" in serializer.validated_data:
             community.custom_header = serializer.validated_data["custom_header"]
 
+        rescore = False
+        for field in ["post_ranking", "comment_ranking"]:
+            if field in serializer.validated_data:
+                value = serializer.validated_data[field]
+                rescore = rescore or getattr(community, field) != value
+                setattr(community, field, value)
+
         community.save()
+        if rescore:
+            django_rq.enqueue(rescore_community_job, community.id)
 
         Link.objects.filter(community=community).delete()
         for link in serializer.validated_data["links"]:
@@ -551,10 +597,74 @@ class CommunityDetail(APIView):
             pk__in=new_fields
         ).delete()
 
+        # The updates above skip model signals
+        access.invalidate_community(community.id)
+        community_cache.invalidate(community.id)
+        render.bump_community(community.id)
+        response_cache.bump(community.id)
+        response_cache.bump(community.id, "chat")
+        response_cache.bump_access(community.id)
+        refresh_feeds(community)
+
         analytics_event(request, "Admin_Settings", serializer.validated_data)
         return Response(serializer.data)
 
 
+class Bootstrap(APIView):
+    """
+    What the frontend loads on startup, from one request: community, self,
+    channels, chatrooms, notifications (the unread count) and posts (a page
+    of CommunityPostList, taking its query params). ?include= picks which,
+    comma separated; everything by default. Logged-out readers only get the
+    public parts. "status" has each part's status code; a part that fails
+    is null, and doesn't fail the others.
+    """
+
+    permission_classes = (IsAuthenticatedOrReadOnly,)
+    PARTS = ("community", "self", "channels", "chatrooms", "notifications", "posts")
+    PUBLIC_PARTS = ("community", "chatrooms", "posts")
+
+    def get(self, request, community_url):
+        community_id = Community.id_from_host(community_url)
+        include = request.query_params.get("include")
+        include = include.split(",") if include else self.PARTS
+        if any(part not in self.PARTS for part in include):
+            return response_400("include must be some of " + ",".join(self.PARTS))
+        if not request.user.is_authenticated:
+            include = [part for part in include if part in self.PUBLIC_PARTS]
+        return response_cache.cached_response(
+            request,
+            community_id,
+            lambda: self._get(request, community_id, include),
+            scopes=("community", "chat"),
+        )
+
+    def _get(self, request, community_id, include):
+        parts = {
+            "community": lambda: CommunityDetail()._get(request, community_id),
+            "self": lambda: Response(SelfSerializer(request.user.person).data),
+            "channels": lambda: ChannelList()._get(request),
+            "chatrooms": lambda: ChatRoomList()._get(request, community_id),
+            "notifications": lambda: ReadNotifications().get(request),
+            "posts": lambda: CommunityPostList()._get(request, community_id),
+        }
+        data = {"status": {}}
+        for part in include:
+            data[part], data["status"][part] = self._part(parts[part])
+        return Response(data)
+
+    def _part(self, load):
+        try:
+            response = load()
+        except Http404:
+            return None, status.HTTP_404_NOT_FOUND
+        except PermissionDenied:
+            return None, status.HTTP_403_FORBIDDEN
+        if response.status_code != status.HTTP_200_OK:
+            return None, response.status_code
+        return response.data, response.status_code
+
+
 class CommunityUploadPhoto(APIView):
     def put(self, request, community_url, format=None):
         community_id = Community.id_from_host(community_url)
@@ -596,8 +706,7 @@ class PostCreate(APIView):
         if request.user.person.admin or not channel.post_admin_only:
             sanitized_content = sanitize_html(serializer.validated_data["content"])
             post = serializer.save(owner=request.user.person, content=sanitized_content)
-            post.upvotes.add(request.user.person)
-            post.rescore()
+            post.add_vote(request.user.person)
             django_rq.enqueue(post_created, post)
             analytics_event(request, "Post_Created", serializer.data)
             return Response(serializer.data)
@@ -618,20 +727,56 @@ class PostDetail(APIView):
         return Response(serializer.data)
 
     def get(self, request, post_id):
-        post = get_object(Post, post_id, request)
+        community_id = Post.community_id_for(post_id)
+
+        def cached():
+            return response_cache.cached_response(
+                request,
+                community_id,
+                lambda: self._get(request, post_id),
+                on_hit=lambda data: record_view(int(post_id)),
+            )
 
-        if request.user.is_authenticated:
-            if not UserPostView.objects.filter(
-                person=request.user.person, date=date.today(), post=post
-            ).exists():
-                upv = UserPostView(person=request.user.person, post=post)
-                upv.save()
+        if community_id is None:
+            return cached()
+        # A 304 records no view: nothing has checked the viewer can see it
+        return conditional.conditional_response(
+            request,
+            [
+                render.post_version_key(int(post_id)),
+                render.community_version_key(community_id),
+            ],
+            cached,
+            surrogate_keys=[
+                conditional.post_key(int(post_id)),
+                conditional.community_key(community_id),
+            ],
+        )
 
-        post.views = F("views") + 1
-        post.save()
-        post.refresh_from_db()
-        serializer = PostSerializer(post, context=person_context(request))
-        return Response(serializer.data)
+    def _get(self, request, post_id):
+        post = get_object(Post, post_id, request)
+
+        person_id = (
+            request.user.person.id if request.user.is_authenticated else None
+        )
+        depth = parse_limit(request.query_params.get("depth"))
+        breadth = parse_limit(request.query_params.get("breadth"))
+        data = render.shared_post(
+            post,
+            lambda: PostSerializer(
+                post,
+                context={
+                    "person": None,
+                    "comment_tree": CommentTree(
+                        post, max_depth=depth, max_breadth=breadth
+                    ),
+                },
+            ).data,
+            variant="detail:%s:%s" % (depth, breadth),
+        )
+        data["views"] = post.views + record_view(post.id, person_id)
+        viewer_overlay(person_context(request)["person"], post.community_id, [data])
+        return Response(data)
 
     def delete(self, request, post_id):
         post = edit_object(Post, post_id, request)
@@ -641,6 +786,38 @@ class PostDetail(APIView):
         return Response(serializer.data)
 
 
+class PostComments(APIView):
+    permission_classes = (IsAuthenticatedOrReadOnly,)
+
+    def get(self, request, post_id):
+        post = get_object(Post, post_id, request)
+        parent_id = parse_limit(request.query_params.get("parent"))
+        offset = parse_limit(request.query_params.get("cursor")) or 0
+        tree = CommentTree(
+            post,
+            max_depth=parse_limit(request.query_params.get("depth")),
+            max_breadth=parse_limit(request.query_params.get("breadth")),
+        )
+        if parent_id is not None and parent_id not in tree.by_id:
+            raise Http404()
+
+        children = tree.children(parent_id, offset)
+        serializer = CommentSerializer(
+            children,
+            many=True,
+            context={**person_context(request), "comment_tree": tree},
+        )
+        more = tree.more(parent_id, len(children), offset)
+        return Response(
+            {
+                "cursor": more["cursor"] if more else None,
+                "has_next": more is not None,
+                "has_previous": offset > 0,
+                "data": serializer.data,
+            }
+        )
+
+
 class CommentCreate(APIView):
     permission_classes = (IsAuthenticated,)
 
@@ -652,8 +829,7 @@ class CommentCreate(APIView):
         comment = serializer.save(
             post=post, owner=request.user.person, content=sanitized_content
         )
-        comment.upvotes.add(request.user.person)
-        comment.rescore()
+        comment.add_vote(request.user.person)
 
         serializer = CommentSerializer(comment, context=person_context(request))
         django_rq.enqueue(comment_created, comment)
@@ -675,7 +851,15 @@ class CommentDetail(APIView):
 
     def get(self, request, comment_id):
         comment = get_object(Comment, comment_id, request)
-        serializer = CommentSerializer(comment, context=person_context(request))
+        tree = CommentTree(
+            comment.post,
+            max_depth=parse_limit(request.query_params.get("depth")),
+            max_breadth=parse_limit(request.query_params.get("breadth")),
+        )
+        serializer = CommentSerializer(
+            tree.by_id[comment.id],
+            context={**person_context(request), "comment_tree": tree},
+        )
         return Response(serializer.data)
 
     def delete(self, request, comment_id):
@@ -693,17 +877,17 @@ class CommentDetail(APIView):
 def common_voting(request, obj, obj_type):
     serializer = VoteSerializer(data=request.data)
     serializer_check(serializer)
-    if serializer.validated_data["vote"]:
-        if not obj.upvotes.filter(pk=request.user.person.id).exists():
-            obj.upvotes.add(request.user.person)
-            django_rq.enqueue(object_liked, obj, obj_type, request.user.person)
+    vote = serializer.validated_data["vote"]
+    if vote:
+        if obj.add_vote(request.user.person):
+            django_rq.enqueue(
+                object_liked, obj_type, obj.id, obj.owner_id, request.user.person.id
+            )
             analytics_event(request, obj_type + "_Vote", {"id": obj.id})
     else:
-        if obj.upvotes.filter(pk=request.user.person.id).exists():
-            obj.upvotes.remove(request.user.person)
+        if obj.remove_vote(request.user.person):
             analytics_event(request, obj_type + "_Unvote", {"id": obj.id})
-    obj.rescore()
-    return Response({"vote": obj.user_vote(request.user.person), "points": obj.points})
+    return Response({"vote": vote, "points": obj.points})
 
 
 class CommentVote(APIView):
@@ -728,7 +912,7 @@ def filter_order_posts_by_request(request):
         return Post.objects.order_by("-posted")
     if sort_query == "top":
         time = request.query_params.get("time")
-        rtn = Post.objects.annotate(u_count=Count("upvotes")).order_by("-u_count")
+        rtn = Post.objects.order_by("-points")
         if time == "day":
             return rtn.filter(posted__gte=timezone.now() - timedelta(days=1))
         if time == "week":
@@ -742,15 +926,116 @@ def filter_order_posts_by_request(request):
     return Post.objects.order_by("-pinned", "-score")
 
 
+def feed_offset(request):
+    cursor = request.query_params.get("cursor")
+    if not cursor:
+        return 0
+    values = decode_cursor(cursor)
+    if len(values) == 1 and isinstance(values[0], int) and values[0] >= 0:
+        return values[0]
+    return None
+
+
+def offset_page_info(offset, has_next, step=10):
+    return {
+        "cursor": encode_cursor([offset + step]) if has_next else None,
+        "has_next": has_next,
+        "has_previous": offset > 0,
+    }
+
+
+def refresh_feeds(community):
+    if feeds.enabled() and feeds.claim_rebuild(community.id):
+        django_rq.enqueue(rebuild_community_feeds, community.id)
+
+
+def feed_posts(request, community, channel_query, step=10):
+    """
+    Serves a page from the Redis feeds, or returns None when the request
+    has to go to the database.
+    """
+    sort = feeds.sort_for(
+        request.query_params.get("sort"), request.query_params.get("time")
+    )
+    offset = feed_offset(request)
+    if (
+        not feeds.enabled()
+        or sort is None
+        or offset is None
+        or not wants_cursor(request)
+    ):
+        return None
+    if not feeds.is_built(community.id):
+        refresh_feeds(community)
+        return None
+
+    if channel_query:
+        scopes = [feeds.channel_scope(int(channel_query))]
+    else:
+        scopes = [feeds.community_scope(community.id)]
+        if request.user.is_authenticated:
+            scopes += [
+                feeds.channel_scope(c)
+                for c in request.user.person.viewer_context().private_channel_ids()
+            ]
+
+    ids, has_next = feeds.page(scopes, sort, offset, step)
+    posts = Post.objects.filter(
+        id__in=ids, active=True, community=community
+    ).select_related("owner", "channel")
+    by_id = {post.id: post for post in defer_content(posts, content_mode(request))}
+    paged_posts = [by_id[i] for i in ids if i in by_id]
+    return (paged_posts, offset_page_info(offset, has_next, step))
+
+
+def defer_content(objs, mode, prefix=""):
+    """
+    Skips loading the text columns the response won't show.
+    """
+    if mode == "full":
+        return objs.defer(prefix + "plaintext")
+    return objs.defer(prefix + "content", prefix + "plaintext")
+
+
+def render_posts(request, community, posts):
+    """
+    BasicPostSerializer output for a page of posts, from the shared
+    rendering cache, with the viewer's fields filled in and ?fields= applied.
+    """
+    posts = list(posts)
+    mode = content_mode(request)
+    data = render.shared_posts(
+        posts,
+        lambda missing: BasicPostSerializer(
+            missing, many=True, context={"person": None, "content": mode}
+        ).data,
+        variant="basic:" + mode,
+    )
+    for post, post_data in zip(posts, data):
+        post_data["views"] = post.views
+    data = viewer_overlay(person_context(request)["person"], community.id, data)
+    return select_fields(data, requested_fields(request))
+
+
 class CommunityPostList(APIView):
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
     def get(self, request, community_url):
         community_id = Community.id_from_host(community_url)
+        return response_cache.cached_response(
+            request, community_id, lambda: self._get(request, community_id)
+        )
+
+    def _get(self, request, community_id):
         community = get_object(Community, community_id, request)
-        posts = filter_order_posts_by_request(request)
         channel_query = request.query_params.get("channel")
-        page = request.query_params.get("page", 1)
+        feed = feed_posts(request, community, channel_query)
+        if feed:
+            paged_posts, page_info = feed
+            page_info.update({"data": render_posts(request, community, paged_posts)})
+            return Response(page_info)
+
+        posts = filter_order_posts_by_request(request)
         if channel_query:
             channel = int(channel_query)
             posts = posts.filter(channel=channel)
@@ -763,12 +1048,18 @@ class CommunityPostList(APIView):
                 )
                 | Q(channel=None),
             )
-        posts = posts.filter(active=True, community=community)
-        paged_posts, page_info = get_page_info(page, posts)
-        serializer = BasicPostSerializer(
-            paged_posts, many=True, context=person_context(request)
+        posts = posts.filter(active=True, community=community).select_related(
+            "owner", "channel"
         )
-        page_info.update({"data": serializer.data})
+        posts = defer_content(posts, content_mode(request))
+        offset = feed_offset(request)
+        if offset and wants_cursor(request):
+            paged_posts = list(posts[offset : offset + 11])
+            page_info = offset_page_info(offset, len(paged_posts) > 10)
+            paged_posts = paged_posts[:10]
+        else:
+            paged_posts, page_info = paginate(request, posts)
+        page_info.update({"data": render_posts(request, community, paged_posts)})
         return Response(page_info)
 
 
@@ -776,6 +1067,13 @@ class ChannelList(APIView):
     permission_classes = (IsAuthenticated,)
 
     def get(self, request):
+        return conditional.conditional_response(
+            request,
+            [render.community_version_key(request.user.person.community_id)],
+            lambda: self._get(request),
+        )
+
+    def _get(self, request):
         channels = request.user.person.community.allowed_channels(request.user.person)
         serializer = BasicChannelSerializer(channels, many=True)
         return Response(serializer.data)
@@ -820,6 +1118,7 @@ class ChannelDetail(APIView):
         channel.private_members.add(*members)
 
         serializer.save()
+        refresh_feeds(channel.community)
         serializer = ChannelSerializer(channel)
         return Response(serializer.data)
 
@@ -926,10 +1225,15 @@ class CommunityPersonList(APIView):
 
     def get(self, request, community_url):
         community_id = Community.id_from_host(community_url)
+        return response_cache.cached_response(
+            request, community_id, lambda: self._get(request, community_id)
+        )
+
+    def _get(self, request, community_id):
         community = get_object(Community, community_id, request)
         people = Person.objects.filter(community=community, superadmin_api_only=False)
         serializer = BasicPersonSerializer(people, many=True)
-        return Response(serializer.data)
+        return Response(select_fields(serializer.data, requested_fields(request)))
 
 
 class PersonDetail(APIView):
@@ -956,6 +1260,8 @@ class PersonDetail(APIView):
 
     def get(self, request, person_id):
         person = get_object(Person, person_id, request)
+        fields = requested_fields(request)
+        mode = content_mode(request)
         posts = person._posts.filter(
             Q(
                 channel__in=person.shared_channels(
@@ -963,7 +1269,7 @@ class PersonDetail(APIView):
                 )
             )
             | Q(channel=None)
-        )
+        ).select_related("owner", "channel")
         comments = person._comments.filter(
             Q(
                 post__channel__in=person.shared_channels(
@@ -971,16 +1277,20 @@ class PersonDetail(APIView):
                 )
             )
             | Q(post__channel=None)
-        ).exclude(post__title="[deleted]")
+        ).exclude(post__title="[deleted]").select_related("post")
+        posts = defer_content(posts, mode)
+        comments = defer_content(comments, mode)
+        comments = comments.defer("post__content", "post__plaintext")
+        if fields and "posts" not in fields:
+            posts = []
+        if fields and "comments" not in fields:
+            comments = []
         serializer = PersonSerializer(
             person,
-            context={
-                **person_context(request),
-                **{"posts": posts, "comments": comments},
-            },
+            context={**list_context(request), "posts": posts, "comments": comments},
         )
 
-        return Response(serializer.data)
+        return Response(select_fields(serializer.data, fields))
 
     def delete(self, request, person_id):
         if not request.user.person.admin:
@@ -1045,22 +1355,40 @@ class ChatRoomList(APIView):
 
     def get(self, request, community_url):
         community_id = Community.id_from_host(community_url)
-        community = get_object(Community, community_id, request)
-        rooms = (
-            community.allowed_chatrooms(
-                request.user.person if request.user.is_authenticated else None
-            )
-            .annotate(
-                msg_count=Count("messages"),
-                last_message_posted=Max("messages__posted"),
-            )
-            .filter(Q(msg_count__gt=0) | Q(private=False))
-            .order_by("-last_message_posted")
+        return conditional.conditional_response(
+            request,
+            [
+                response_cache.version_key("chat", community_id),
+                render.community_version_key(community_id),
+            ],
+            lambda: response_cache.cached_response(
+                request,
+                community_id,
+                lambda: self._get(request, community_id),
+                scopes=("community", "chat"),
+            ),
+            surrogate_keys=[
+                conditional.community_key(community_id),
+                conditional.chat_key(community_id),
+            ],
         )
-        serializer = ChatRoomSerializer(
-            rooms, many=True, context=person_context(request)
+
+    def _get(self, request, community_id):
+        community = get_object(Community, community_id, request)
+        context = person_context(request)
+        rooms = list(
+            community.allowed_chatrooms(context["person"])
+            .filter(Q(message_count__gt=0) | Q(private=False))
+            .select_related("last_message__sender")
+            .prefetch_related("private_members")
+            .order_by("-last_posted")
         )
-        return Response(serializer.data)
+        if context["person"]:
+            context["last_read"] = last_read_ids(
+                context["person"].id, [room.id for room in rooms]
+            )
+        serializer = ChatRoomSerializer(rooms, many=True, context=context)
+        return Response(select_fields(serializer.data, requested_fields(request)))
 
     def post(self, request, community_url):
         community_id = Community.id_from_host(community_url)
@@ -1089,22 +1417,53 @@ class ChatRoomRead(APIView):
         room = get_object(ChatRoom, room_id, request)
         serializer = ChatRoomReadSerializer(data=request.data)
         serializer_check(serializer)
-        metadata = PersonChatRoomMetadata.objects.filter(
-            chatroom=room, person=request.user.person
-        ).first()
-        if metadata:
-            metadata.last_read = serializer.validated_data["read"]
-        else:
-            metadata = PersonChatRoomMetadata(
-                chatroom=room,
-                person=request.user.person,
-                last_read=serializer.validated_data["read"],
-            )
-        metadata.save()
+        # Buffered in Redis; cron.py --flush-reads writes it to the database
+        chat_reads.record_read(
+            request.user.person.id, room.id, serializer.validated_data["read"].id
+        )
+        conditional.bump_people([request.user.person.id])
 
         return Response("OK")
 
 
+class ChatEvents(APIView):
+    permission_classes = (IsAuthenticatedOrReadOnly,)
+
+    def get(self, request, community_url):
+        community_id = Community.id_from_host(community_url)
+        community = get_object(Community, community_id, request)
+        since = request.GET.get("since")
+        if not chat_events.valid_id(since):
+            return response_400("since should be an event id")
+        room_ids = set(
+            community.allowed_chatrooms(
+                request.user.person if request.user.is_authenticated else None
+            ).values_list("id", flat=True)
+        )
+        return Response(chat_events.replay(community.id, since, room_ids))
+
+
+class ChatSearch(APIView):
+    permission_classes = (IsAuthenticatedOrReadOnly,)
+
+    def get(self, request, community_url):
+        community_id = Community.id_from_host(community_url)
+        community = get_object(Community, community_id, request)
+        text = request.query_params.get("q", "").strip()
+        if not text:
+            return response_400("Search for something")
+        rooms = community.allowed_chatrooms(
+            request.user.person if request.user.is_authenticated else None
+        )
+        messages, page_info = get_cursor_page(
+            request.query_params.get("cursor"),
+            Message.search(rooms.values("id"), text),
+            50,
+        )
+        page_info.update({"data": MessageSearchSerializer(messages, many=True).data})
+        return Response(page_info)
+
+
 class ChatRoomDetail(APIView):
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
@@ -1123,28 +1482,14 @@ class DirectMessageCreate(APIView):
         )
         serializer_check(serializer)
         members = serializer.validated_data["private_members"]
-        if len(members) <= 1:
+        if len({m.id for m in members}) <= 1:
             return response_400("Not enough members to chat")
         for m in members:
             if m.community != request.user.person.community:
                 return response_400("Some members don't belong in your community")
-        candidate_dms = ChatRoom.objects.annotate(c=Count("private_members")).filter(
-            c=len(members), community=request.user.person.community
-        )
-        for member in members:
-            candidate_dms = candidate_dms.filter(private_members=member)
-        if candidate_dms.exists():
-            serializer = ChatRoomSerializer(
-                candidate_dms.first(), context=person_context(request)
-            )
-        else:
-            new_room = serializer.save(
-                private=True,
-                room_type=ChatRoom.DIRECT,
-                community=request.user.person.community,
-            )
-            serializer = ChatRoomSerializer(new_room, context=person_context(request))
-        re_publish("system_message", json.dumps(serializer.data))
+        room, _ = ChatRoom.open_direct(request.user.person.community, members)
+        serializer = ChatRoomSerializer(room, context=person_context(request))
+        chat_events.publish(room, "system_message", "room", serializer.data)
         return Response(serializer.data)
 
 
@@ -1152,10 +1497,13 @@ class ChatRoomMessages(APIView):
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
     def get(self, request, room_id):
-        page = request.query_params.get("page", 1)
         chatroom = get_object(ChatRoom, room_id, request)
-        messages = Message.objects.filter(room=chatroom).order_by("-posted")
-        paged_messages, page_info = get_page_info(page, messages, 50)
+        messages = (
+            Message.objects.filter(room=chatroom)
+            .select_related("sender")
+            .order_by("-posted")
+        )
+        paged_messages, page_info = paginate(request, messages, 50)
         serializer = MessageSerializer(paged_messages, many=True)
         page_info.update({"data": serializer.data})
         return Response(page_info)
@@ -1167,11 +1515,14 @@ class MessageDetail(APIView):
     def delete(self, request, message_id):
         message = edit_object(Message, message_id, request)
 
-        re_publish(
-            message.room.id, json.dumps({"delete": message.id, "room": message.room.id})
-        )
         message.message = "[deleted]"
         message.save()
+        chat_events.publish(
+            message.room,
+            message.room.id,
+            "delete",
+            {"delete": message.id, "room": message.room.id},
+        )
         return Response("Deleted")
 
 
@@ -1193,7 +1544,7 @@ class CreateMessage(APIView):
 
         serializer = MessageSerializer(message)
         redis_blob.update(serializer.data)
-        re_publish(message.room.id, json.dumps(redis_blob))
+        chat_events.publish(chatroom, chatroom.id, "message", redis_blob)
 
         if (
             chatroom.room_type == ChatRoom.DIRECT
@@ -1357,20 +1708,34 @@ class Notifications(APIView):
     permission_classes = (IsAuthenticated,)
 
     def get(self, request):
-        page = request.query_params.get("page", 1)
-
         notifications = (
             Notification.objects.filter(notified_user=request.user.person)
+            .select_related(
+                "action_taker",
+                "target_post__owner",
+                "target_post__channel",
+                "target_comment",
+            )
             .order_by("-time")
-            .all()
+            .defer("target_comment__content", "target_comment__plaintext")
+        )
+        notifications = defer_content(
+            notifications, content_mode(request), "target_post__"
+        )
+        paged_notifs, page_info = paginate(request, notifications)
+        serializer = NotificationSerializer(
+            paged_notifs, many=True, context=list_context(request)
+        )
+        page_info.update(
+            {"data": select_fields(serializer.data, requested_fields(request))}
         )
-        paged_notifs, page_info = get_page_info(page, notifications)
-        serializer = NotificationSerializer(paged_notifs, many=True)
-        page_info.update({"data": serializer.data})
         return Response(page_info)
 
     def post(self, request):
         re_set(request.user.username, 0)
+        chat_events.publish_notifications(
+            request.user.person.community_id, request.user.person.id, 0
+        )
         Notification.objects.filter(notified_user=request.user.person).update(read=True)
         return Response("OK")
 
@@ -1411,10 +1776,5 @@ class ActiveUser(APIView):
     permission_classes = (IsAuthenticated,)
 
     def post(self, request):
-        if not UserActiveDate.objects.filter(
-            person=request.user.person, date=date.today()
-        ).exists():
-            uad = UserActiveDate(person=request.user.person)
-            uad.save()
-
+        presence.record_activity(request.user.person)
         return Response("OK")
@@ -0,0 +1,96 @@
+from django.db import connection
+from django.db.models import F, IntegerField
+from django.db.models.expressions import RawSQL
+from django.db.models.sql import UpdateQuery
+from . import feeds, ranking, render
+
+"""
+Votes in one statement. The through table insert (or delete) runs in a CTE,
+and the UPDATE on the voted object adds the number of rows it changed to
+points and recomputes score from the new points, returning both. The row
+lock is held for that one statement only, and concurrent voters serialize
+on it without losing counts.
+"""
+
+DELTA = "(SELECT count(*) FROM changed)"
+ADD = (
+    "INSERT INTO {through} ({target}, {person}) VALUES (%s, %s) "
+    "ON CONFLICT DO NOTHING RETURNING 1"
+)
+REMOVE = "DELETE FROM {through} WHERE {target} = %s AND {person} = %s RETURNING 1"
+VOTE = """
+WITH changed AS ({change})
+UPDATE {table} SET
+    points = points + {delta},
+    points_changed = CASE WHEN {delta} = 0 THEN points_changed ELSE now() END,
+    score = {score}
+WHERE id = %s
+RETURNING points, score, {delta}
+"""
+
+_statements = {}
+
+
+def _compile(model, expression):
+    query = UpdateQuery(model)
+    compiler = query.get_compiler(connection=connection)
+    return compiler.compile(
+        expression.resolve_expression(query, allow_joins=False, for_save=True)
+    )
+
+
+def _score(model, delta):
+    """
+    CASE over the community's ranking algorithm, with points taken as the
+    new value.
+    """
+    points = F("points") + RawSQL(delta, [], output_field=IntegerField())
+    sql, params = _compile(model, model.ranking_name())
+    parts = ["CASE " + sql]
+    params = list(params)
+    for name in model.RANKING_ALGORITHMS:
+        sql, expression_params = _compile(
+            model, ranking.expression(model, name, points)
+        )
+        parts.append("WHEN %s THEN " + sql)
+        params += [name] + list(expression_params)
+    parts.append("ELSE score END")
+    return " ".join(parts), params
+
+
+def _statement(model, vote):
+    if (model, vote) not in _statements:
+        through = model.upvotes.through._meta
+        qn = connection.ops.quote_name
+        delta = DELTA if vote else "-" + DELTA
+        score, params = _score(model, delta)
+        change = (ADD if vote else REMOVE).format(
+            through=qn(through.db_table),
+            target=qn(through.get_field(model._meta.model_name).column),
+            person=qn(through.get_field("person").column),
+        )
+        sql = VOTE.format(
+            change=change, table=qn(model._meta.db_table), delta=delta, score=score
+        )
+        _statements[(model, vote)] = (sql, params)
+    return _statements[(model, vote)]
+
+
+def cast(obj, person, vote):
+    """
+    Adds (vote=True) or removes the person's vote on obj. Updates obj.points
+    and obj.score in place and returns whether the vote changed anything.
+    """
+    sql, params = _statement(type(obj), vote)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [obj.pk, person.pk] + params + [obj.pk])
+        row = cursor.fetchone()
+    if row is None:
+        return False
+    obj.points, obj.score, delta = row
+    if delta and obj._meta.model_name == "post":
+        feeds.update_post_scores(obj)
+        render.bump_post(obj.pk)
+    elif delta:
+        render.bump_post(obj.post_id)
+    return bool(delta)
@@ -94,7 +94,7 @@ def gen_com(name, json_path):
 
         upvotes = random.randint(4, 25)
         for u in range(upvotes):
-            po.upvotes.add(random.choice(people))
+            po.add_vote(random.choice(people))
 
 
 if __name__ == "__main__":
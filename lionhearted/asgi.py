@@ -0,0 +1,14 @@
+"""
+ASGI config for the realtime gateway (forum/gateway.py).
+
+Serve it with uvicorn lionhearted.asgi:application alongside the WSGI app.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lionhearted.settings')
+django.setup()
+
+from forum.gateway import application  # noqa: E402
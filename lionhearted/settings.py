@@ -57,6 +57,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "forum.identity.IdentityMapMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -146,6 +147,20 @@ if "IN_HEROKU" in os.environ:
         }
     }
 
+# Serve hot/top/new post feeds from sorted sets in Redis (see forum/feeds.py)
+REDIS_FEEDS = "REDIS_FEEDS" in os.environ
+
+# Part of every ETag, so a deploy doesn't leave clients on 304s of old output
+RELEASE_VERSION = os.environ.get("HEROKU_RELEASE_VERSION", "")
+
+# Where CDN purges go when cached content changes (see forum/conditional.py):
+# forum.conditional.NoPurge, RecordingPurge or FastlyPurge
+SURROGATE_PURGE_BACKEND = os.environ.get(
+    "SURROGATE_PURGE_BACKEND", "forum.conditional.NoPurge"
+)
+FASTLY_SERVICE_ID = os.environ.get("FASTLY_SERVICE_ID")
+FASTLY_API_KEY = os.environ.get("FASTLY_API_KEY")
+
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
@@ -0,0 +1,151 @@
+from lionhearted import settings
+import os
+import django
+import sys
+import asyncio
+import json
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "lionhearted.settings")
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db.models.signals import pre_delete
+from knox.models import AuthToken
+from forum.models import ChatRoom, Community, Person
+from forum import chat_events, gateway
+import websockets
+
+"""
+Load test for the websocket gateway. Creates a throwaway community with one
+person per socket, opens every socket against a running gateway, publishes
+messages to a public room through chat_events, and reports how long they
+took to reach every socket. Deletes the community afterwards; meant for a
+dev database and a local Redis, not production.
+
+    uvicorn lionhearted.asgi:application --port 8001
+    python loadtest_gateway.py [sockets] [messages] [url]
+
+Thousands of sockets need a higher open file limit (ulimit -n) on both
+sides.
+"""
+
+CONNECT_CONCURRENCY = 200
+PUBLISH_INTERVAL = 0.01
+DELIVERY_TIMEOUT = 30
+
+
+def create_people(sockets):
+    community = Community.objects.create(name="gateway-loadtest-%d" % time.time())
+    users = User.objects.bulk_create(
+        [
+            User(username="%s-%d" % (community.name, i))
+            for i in range(sockets)
+        ]
+    )
+    # bulk_create skips the signals, so none of them are indexed
+    Person.objects.bulk_create(
+        [
+            Person(
+                user=user,
+                community=community,
+                email="%s@example.com" % user.username,
+                username=user.username,
+            )
+            for user in users
+        ]
+    )
+    tokens = [AuthToken.objects.create(user)[1] for user in users]
+    room = ChatRoom.objects.create(
+        community=community, room_type=ChatRoom.ROOM, private=False, name="loadtest"
+    )
+    return community, users, tokens, room
+
+
+def delete_people(community, users):
+    pre_delete.disconnect(Person.pre_delete, sender=Person)
+    community.delete()
+    User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+
+async def open_socket(url, token, limit):
+    async with limit:
+        socket = await websockets.connect(url)
+        await socket.send(json.dumps({"token": token}))
+        ready = json.loads(await socket.recv())
+        if ready["type"] != "ready":
+            raise Exception("gateway said %s" % ready)
+        return socket
+
+
+async def receive(socket, messages, latencies, closed):
+    try:
+        while len(latencies) < messages:
+            event = json.loads(await socket.recv())
+            if event["type"] == "message":
+                latencies.append(time.time() - event["data"]["sent"])
+    except websockets.ConnectionClosed as e:
+        closed.append(e.code)
+
+
+def percentile(values, p):
+    return values[min(int(len(values) * p), len(values) - 1)] * 1000
+
+
+async def run(url, tokens, room, messages):
+    limit = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    start = time.time()
+    sockets = await asyncio.gather(*[open_socket(url, t, limit) for t in tokens])
+    print("Opened %d sockets in %.2fs" % (len(sockets), time.time() - start))
+
+    per_socket = [[] for _ in sockets]
+    closed = []
+    receivers = [
+        asyncio.ensure_future(receive(socket, messages, latencies, closed))
+        for socket, latencies in zip(sockets, per_socket)
+    ]
+    start = time.time()
+    for i in range(messages):
+        chat_events.publish(
+            room, room.id, "message", {"id": i, "message": "load", "sent": time.time()}
+        )
+        await asyncio.sleep(PUBLISH_INTERVAL)
+    await asyncio.wait(receivers, timeout=DELIVERY_TIMEOUT)
+    elapsed = time.time() - start
+
+    latencies = sorted(l for socket_latencies in per_socket for l in socket_latencies)
+    expected = len(sockets) * messages
+    print(
+        "Delivered %d of %d events in %.2fs (%.0f/s), %d sockets closed as slow"
+        % (
+            len(latencies),
+            expected,
+            elapsed,
+            len(latencies) / elapsed,
+            closed.count(gateway.SLOW_CLOSE_CODE),
+        )
+    )
+    if latencies:
+        print(
+            "Latency p50 %.1fms p95 %.1fms p99 %.1fms max %.1fms"
+            % tuple(percentile(latencies, p) for p in (0.5, 0.95, 0.99, 1))
+        )
+    await asyncio.gather(*[socket.close() for socket in sockets])
+
+
+def loadtest(sockets, messages, url):
+    community, users, tokens, room = create_people(sockets)
+    try:
+        asyncio.get_event_loop().run_until_complete(
+            run(url, tokens, room, messages)
+        )
+    finally:
+        delete_people(community, users)
+
+
+if __name__ == "__main__":
+    loadtest(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100,
+        sys.argv[3] if len(sys.argv) > 3 else "ws://localhost:8001/",
+    )
@@ -6,7 +6,6 @@ import sys
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "lionhearted.settings")
 django.setup()
 
-from django.utils.html import strip_tags
 
 from forum.models import Comment, Post, partial_update_objs, Community
 from datetime import datetime, timedelta
@@ -48,7 +47,7 @@ def send_digest(community, _posts, emails):
                     "title": p.title,
                     "link": domain + "/post/" + str(p.id),
                     "author": p.owner.username,
-                    "content": strip_tags(p.content)[:100] + "...",
+                    "content": p.excerpt + "...",
                 }
             )
         content_list.append({"title": ch, "posts": post_list})
@@ -10,7 +10,6 @@ from postmark.core import PMMail
 from django.utils import timezone
 from datetime import timedelta
 from forum.models import *
-from django.db.models import Max
 from django.conf import settings
 from sentry_sdk import capture_exception
 
@@ -81,9 +80,7 @@ def send_notifications(community, email_dict):
 
 
 def user_chat_map(community, frequency):
-    possible_chats = ChatRoom.objects.annotate(
-        last_posted=Max("messages__posted")
-    ).filter(
+    possible_chats = ChatRoom.objects.select_related("last_message").filter(
         room_type=ChatRoom.DIRECT,
         community=community,
         last_posted__gte=timezone.now() - timedelta(days=32),
@@ -94,7 +91,7 @@ def user_chat_map(community, frequency):
             if (
                 person.email
                 and room.last_message
-                and person.id != room.last_message.sender.id
+                and person.id != room.last_message.sender_id
                 and person.notification_frequency == frequency
             ):
                 pcrm = PersonChatRoomMetadata.objects.filter(
@@ -121,6 +118,8 @@ def user_chat_map(community, frequency):
 
 if __name__ == "__main__":
     if len(sys.argv) > 1:
+        # Read receipts still buffered in Redis count as read
+        flush_reads()
         for c in Community.objects.all():
             if sys.argv[1] == "hourly":
                 notifications = Notification.objects.filter(